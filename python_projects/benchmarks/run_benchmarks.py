@@ -0,0 +1,241 @@
+"""Offline benchmarks for the three python_projects pipelines
+
+End-to-end benchmarks run the real fetch functions against stub_server.py, which
+replays the recorded responses in fixtures/ with a simulated API latency. Stage
+benchmarks time the CPU-bound parsing, ranking, aggregation and prompt-building
+steps on synthetic data scaled from the same fixtures. No API credits are used.
+
+    python run_benchmarks.py                          # default sizes: 10k and 100k
+    python run_benchmarks.py --sizes 10000 1000000    # scale the stage benchmarks up
+    python run_benchmarks.py --save baseline.json     # record timings
+    python run_benchmarks.py --compare baseline.json  # exit 1 if anything got slower
+
+Requires the packages of all three projects (numpy, requests, openai,
+python-dotenv).
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from stub_server import load_fixture, start_stub_server
+
+PROJECTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UNLIMITED = 10 ** 9  # Rate limit used in benchmarks, so only the code and the stub latency are measured
+
+def load_module(name, relative_path):
+    """Import one of the project scripts by path (their folders are not packages)"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PROJECTS_DIR, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def timed(function, repeat=1):
+    """Best wall-clock time of `repeat` calls, with the scripts' console output silenced"""
+    best = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+class Benchmarks:
+    def __init__(self, workdir, latency, repeat):
+        self.workdir = workdir
+        self.repeat = repeat
+        self.results = {}
+        self.server, self.stub, base_url = start_stub_server(latency=latency)
+        os.environ["SERPAPI_BACKEND"] = base_url
+        os.environ["SERPAPI_CACHE_PATH"] = os.path.join(workdir, "serpapi_cache.sqlite3")
+        os.environ.setdefault("SERPAPI_API_KEY", "benchmark")
+
+        # Modules read their configuration at import time, and the predictor opens debug.log in the cwd
+        with contextlib.chdir(workdir) if hasattr(contextlib, "chdir") else _chdir(workdir):
+            self.trending = load_module("trending_products", "trending-products-amazon-api/trending_products.py")
+            self.competitor = load_module("competitor_traker", "competitor-tracker-amazon-api/competitor_traker.py")
+            self.predictor = load_module("predictor_main", "business-success-predictor/main.py")
+        self.predictor.logger.setLevel(logging.WARNING)
+        self.competitor.rate_limiter = self.competitor.TokenBucket(UNLIMITED, UNLIMITED)
+        self.predictor.rate_limiter = self.predictor.TokenBucket(UNLIMITED, UNLIMITED)
+
+    def fresh_cache(self, module):
+        """A new, empty response cache so every end-to-end run goes to the (stub) API"""
+        path = tempfile.mktemp(suffix=".sqlite3", dir=self.workdir)
+        return module.ResponseCache(path=path, ttls=module.CACHE_TTLS)
+
+    def record(self, name, seconds, items, requests=None):
+        self.results[name] = {"seconds": seconds, "items": items}
+        rate = f"{items / seconds:12,.0f}/s" if seconds else ""
+        extra = f"  ({requests} requests)" if requests is not None else ""
+        print(f"{name:<52} {items:>9,} {seconds * 1000:11.1f} ms {rate}{extra}")
+
+    def run_end_to_end(self, request_latency):
+        print(f"\nEnd to end against the stub server ({request_latency * 1000:.0f} ms per request)")
+        trending, competitor, predictor = self.trending, self.competitor, self.predictor
+
+        def trending_analyzer(cache=None):
+            return trending.ImprovedSmartHomeTrendingAnalyzer(
+                "", cache=cache or self.fresh_cache(trending), rate_limiter=trending.TokenBucket(UNLIMITED, UNLIMITED))
+
+        for label, workers in [("serial", 1), ("concurrent x8", 8)]:
+            analyzer = trending_analyzer()
+            before = self.stub.request_count
+            products = []
+            seconds = timed(lambda: products.extend(analyzer.fetch_smart_home_best_sellers(pages=10, max_workers=workers)))
+            self.record(f"trending: fetch_smart_home_best_sellers {label}", seconds, len(products),
+                        self.stub.request_count - before)
+
+        warm = trending_analyzer(cache=analyzer.cache)
+        seconds = timed(lambda: warm.fetch_smart_home_best_sellers(pages=10), self.repeat)
+        self.record("trending: fetch_smart_home_best_sellers cached", seconds, len(products))
+
+        competitor.response_cache = self.fresh_cache(competitor)
+        found = []
+        seconds = timed(lambda: found.extend(competitor.extract_amazon_data("", "Bluetooth Speakers")))
+        self.record("competitor: extract_amazon_data", seconds, len(found))
+
+        competitor.response_cache = self.fresh_cache(competitor)
+        keywords = [f"keyword {i}" for i in range(10)]
+        found = []
+        before = self.stub.request_count
+        seconds = timed(lambda: found.extend(competitor.track_keywords("", keywords, pages=3, max_workers=10)))
+        self.record("competitor: track_keywords 10 x 3 pages", seconds, len(found), self.stub.request_count - before)
+
+        for label, max_reviews in [("8 reviews/shop", 8), ("40 reviews/shop", 40)]:
+            predictor.response_cache = self.fresh_cache(predictor)
+            competitors = []
+            before = self.stub.request_count
+
+            def build():
+                local_results = predictor.fetch_shops_details(predictor.get_search_params("Austin, TX", ""))
+                competitors.extend(predictor.build_competitor_data(local_results, max_reviews=max_reviews))
+
+            seconds = timed(build)
+            reviews = sum(len(shop["customer_reviews"]) for shop in competitors)
+            self.record(f"predictor: build_competitor_data {label}", seconds, reviews, self.stub.request_count - before)
+
+    def run_stages(self, size):
+        print(f"\nStages on {size:,} synthetic items")
+        trending, competitor, predictor = self.trending, self.competitor, self.predictor
+        page = load_fixture("amazon_organic_results.json")["organic_results"]
+        chunk = [{**page[i % len(page)], "asin": f"B{i:09d}"} for i in range(min(size, 10000))]
+        chunks, remainder = divmod(size, len(chunk))
+
+        analyzer = trending.ImprovedSmartHomeTrendingAnalyzer("", cache=self.fresh_cache(trending))
+        products = []
+
+        def extract():
+            products.clear()
+            for _ in range(chunks):
+                products.extend(analyzer.extract_products_from_results({"organic_results": chunk}, 1))
+            products.extend(analyzer.extract_products_from_results({"organic_results": chunk[:remainder]}, 1))
+
+        self.record(f"trending: extract_products_from_results [{size}]", timed(extract, self.repeat), len(products))
+
+        def rank():
+            columns = trending.ProductColumns(products)
+            for scores in (columns.reviews, columns.rating, columns.revenue, columns.trending_scores()):
+                columns.top_indices(scores, 10)
+
+        self.record(f"trending: columns + four top-10 rankings [{size}]", timed(rank, self.repeat), len(products))
+        self.record(f"trending: generate_comprehensive_json [{size}]",
+                    timed(lambda: analyzer.generate_comprehensive_json(products), self.repeat), len(products))
+
+        records = []
+
+        def parse():
+            records.clear()
+            for _ in range(chunks):
+                records.extend(competitor.parse_product(item, "keyword", 1) for item in chunk)
+            records.extend(competitor.parse_product(item, "keyword", 1) for item in chunk[:remainder])
+
+        self.record(f"competitor: parse_product [{size}]", timed(parse, self.repeat), len(records))
+        self.record(f"competitor: aggregate_products [{size}]",
+                    timed(lambda: competitor.aggregate_products(records), self.repeat), len(records))
+        del products, records
+
+        review_page = load_fixture("google_maps_reviews.json")["reviews"]
+        shops = load_fixture("google_maps_local_results.json")["local_results"]
+        per_shop = max(size // len(shops), 1)
+        competitors = [
+            {
+                "business_name": shop["title"], "address": shop["address"], "GPS_coordinates": shop["gps_coordinates"],
+                "star_rating": shop["rating"], "review_count": shop["reviews"], "opening_hours": shop["operating_hours"],
+                "price_level": shop["price"],
+                "customer_reviews": [
+                    {"review_text": f"{review['snippet']} ({i})", "review_star_rating": review["rating"], "timestamp": review["date"]}
+                    for i, review in ((i, review_page[i % len(review_page)]) for i in range(per_shop))
+                ]
+            }
+            for shop in shops
+        ]
+        self.record(f"predictor: format_competitor_data [{size}]",
+                    timed(lambda: predictor.format_competitor_data(competitors), self.repeat), per_shop * len(shops))
+
+    def close(self):
+        self.server.shutdown()
+
+@contextlib.contextmanager
+def _chdir(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+def compare(results, baseline_path, tolerance):
+    """Print timings that are more than `tolerance` times slower than the baseline; returns their count"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = 0
+    print(f"\nCompared with {baseline_path} (tolerance x{tolerance})")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["seconds"] / baseline[name]["seconds"] if baseline[name]["seconds"] else 1.0
+        if ratio > tolerance:
+            regressions += 1
+            print(f"  REGRESSION {name}: {baseline[name]['seconds'] * 1000:.1f} ms -> {result['seconds'] * 1000:.1f} ms (x{ratio:.2f})")
+    print(f"  {regressions} regression(s)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the python_projects pipelines offline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="Item counts for the stage benchmarks")
+    parser.add_argument("--latency-ms", type=float, default=50, help="Simulated API latency of the stub server")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage benchmark (best is reported)")
+    parser.add_argument("--skip-end-to-end", action="store_true")
+    parser.add_argument("--save", metavar="FILE", help="Write the timings to a JSON file")
+    parser.add_argument("--compare", metavar="FILE", help="Compare with timings saved by --save")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        benchmarks = Benchmarks(workdir, args.latency_ms / 1000, args.repeat)
+        print(f"{'benchmark':<52} {'items':>9} {'time':>14} {'throughput':>14}")
+        try:
+            if not args.skip_end_to_end:
+                benchmarks.run_end_to_end(args.latency_ms / 1000)
+            for size in args.sizes:
+                benchmarks.run_stages(size)
+        finally:
+            benchmarks.close()
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(benchmarks.results, f, indent=2)
+        print(f"\nTimings saved to {args.save}")
+    if args.compare and compare(benchmarks.results, args.compare, args.tolerance):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
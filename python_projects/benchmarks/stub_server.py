@@ -0,0 +1,148 @@
+"""Local stand-in for the SerpApi /search endpoint that replays recorded fixtures
+
+Supports the engines used in python_projects: amazon (paginated with `page`),
+google_maps (paginated with `start`) and google_maps_reviews (paginated with
+`next_page_token`). Identifiers are rewritten per page so every page holds new
+products, shops and reviews, until the configured page limit returns no results.
+
+Point a script at it with the SERPAPI_BACKEND environment variable:
+
+    python stub_server.py --port 8000 --latency-ms 300
+    SERPAPI_BACKEND=http://127.0.0.1:8000 python ../trending-products-amazon-api/trending_products.py
+"""
+import argparse
+import copy
+import json
+import os
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return json.load(f)
+
+class StubSerpApi:
+    """Builds responses from the fixtures; thread-safe request counting"""
+
+    def __init__(self, latency=0.0, amazon_pages=7, maps_pages=3, review_pages=5):
+        self.latency = latency
+        self.amazon_pages = amazon_pages
+        self.maps_pages = maps_pages
+        self.review_pages = review_pages
+        self.amazon = load_fixture("amazon_organic_results.json")
+        self.maps = load_fixture("google_maps_local_results.json")
+        self.reviews = load_fixture("google_maps_reviews.json")
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+    def respond(self, params):
+        with self.lock:
+            self.request_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+        engine = params.get("engine")
+        if engine == "amazon":
+            return self.amazon_page(params)
+        if engine == "google_maps":
+            return self.maps_page(params)
+        if engine == "google_maps_reviews":
+            return self.reviews_page(params)
+        return {"error": f"Unsupported engine: {engine}"}
+
+    def amazon_page(self, params):
+        page = int(params.get("page", 1))
+        response = copy.deepcopy(self.amazon)
+        if page > self.amazon_pages:
+            response["organic_results"] = []
+            return response
+        tag = f"{params.get('node') or params.get('k', '')}|{page}"
+        for item in response["organic_results"]:
+            checksum = zlib.crc32(f"{item['asin']}|{tag}".encode())
+            item["asin"] = f"{item['asin'][:4]}{checksum % 10**6:06d}"
+        return response
+
+    def maps_page(self, params):
+        start = int(params.get("start", 0))
+        response = copy.deepcopy(self.maps)
+        if start // 20 >= self.maps_pages:
+            response["local_results"] = []
+            return response
+        tag = f"{params.get('q', '')}|{params.get('ll', '')}|{start}"
+        for shop in response["local_results"]:
+            shop["data_id"] = f"{shop['data_id']}:{zlib.crc32(tag.encode()) % 10**6:06d}"
+        return response
+
+    def reviews_page(self, params):
+        token = params.get("next_page_token")
+        page = int(token) if token and token.isdigit() else 0
+        response = copy.deepcopy(self.reviews)
+        reviews = response["reviews"]
+        if page:
+            reviews = (reviews * 2)[:int(params.get("num", 10))]
+        response["reviews"] = [
+            {**review, "review_id": f"{params.get('data_id')}-{page}-{i}"}
+            for i, review in enumerate(copy.deepcopy(reviews))
+        ]
+        if page + 1 < self.review_pages:
+            response["serpapi_pagination"] = {"next_page_token": str(page + 1)}
+        else:
+            response.pop("serpapi_pagination", None)
+        return response
+
+def make_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+        disable_nagle_algorithm = True  # Headers and body are separate writes; don't let the body wait for an ACK
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path not in ("/search", "/search.json"):
+                self.send_error(404)
+                return
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            body = json.dumps(stub.respond(params)).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+class StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # The default backlog of 5 drops connections when async clients open hundreds at once
+
+def start_stub_server(port=0, **options):
+    """Start the stub in a background thread; returns (server, stub, base_url)"""
+    stub = StubSerpApi(**options)
+    server = StubHTTPServer(("127.0.0.1", port), make_handler(stub))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stub, f"http://127.0.0.1:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded SerpApi fixtures on a local port")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Simulated API latency per request")
+    parser.add_argument("--amazon-pages", type=int, default=7)
+    parser.add_argument("--maps-pages", type=int, default=3)
+    parser.add_argument("--review-pages", type=int, default=5)
+    args = parser.parse_args()
+    server, _, base_url = start_stub_server(args.port, latency=args.latency_ms / 1000, amazon_pages=args.amazon_pages,
+                                            maps_pages=args.maps_pages, review_pages=args.review_pages)
+    print(f"Stub SerpApi listening on {base_url} (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
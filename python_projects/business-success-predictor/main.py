@@ -1,17 +1,37 @@
 import os
+import re
+import sys
+import csv
 import json
+import math
+import argparse
+import asyncio
 import time
+import sqlite3
 import logging
+import importlib.util
+import threading
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from dotenv import load_dotenv
-from serpapi import GoogleSearch
 from openai import OpenAI
-import requests
+
+# Rate limiters, SerpApi clients and the response cache shared with the other tools (the folders are not packages)
+_serpapi_spec = importlib.util.spec_from_file_location(
+    "serpapi_common", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "serpapi_common.py"))
+serpapi_common = importlib.util.module_from_spec(_serpapi_spec)
+_serpapi_spec.loader.exec_module(serpapi_common)
+TokenBucket, ResponseCache = serpapi_common.TokenBucket, serpapi_common.ResponseCache
+SerpApiClient, AsyncSerpApiClient = serpapi_common.SerpApiClient, serpapi_common.AsyncSerpApiClient
 
 # Setup logger
 logger = logging.getLogger("coffee_agent")
-logger.setLevel(logging.DEBUG)
-file_handler = logging.FileHandler('debug.log')
+logger.setLevel(os.getenv("LOG_LEVEL", "DEBUG").upper())  # INFO skips building debug payloads entirely
+file_handler = logging.FileHandler('debug.log', delay=True)  # Opened on the first record, not at import
 file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
 logger.addHandler(file_handler)
 stream_handler = logging.StreamHandler()
@@ -19,6 +39,183 @@ stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(mess
 logger.addHandler(stream_handler)
 
 BUSINESS_TYPE = "Coffee Shop"
+REQUESTS_PER_SECOND = 5  # Keep within your SerpApi plan's throughput limit
+REQUESTS_BURST = 5
+REVIEW_WORKERS = 5
+REVIEWS_PER_SHOP = 8  # Reviews sent to the LLM per shop (the first page holds 8)
+HARVEST_REVIEW_BUDGET = 1000  # Reviews per shop when harvesting to a JSONL file
+CACHE_TTLS = {
+    "google_maps": 7 * 24 * 3600,          # Shop listings change slowly
+    "google_maps_reviews": 24 * 3600,
+}
+PROMPT_TOKEN_BUDGET = 6000  # Approximate tokens of competitor data sent to the LLM
+CHARS_PER_TOKEN = 4         # Rough average for English text
+MAX_REVIEW_CHARS = 300      # Longer reviews are truncated in the prompt
+LLM_BASE_URL = "http://localhost:11434/v1"  # Local Ollama API
+LLM_MODEL = "gpt-oss:20b"
+LLM_MAP_WORKERS = 2  # Parallel per-competitor summaries in map-reduce mode
+BATCH_SEARCH_WORKERS = 4  # Locations gathering competitor data at once
+BATCH_LLM_WORKERS = 1     # Concurrent LLM calls; a local model usually handles one at a time
+SWEEP_ZOOM = 14           # Map zoom of each grid cell, as in single-location searches
+SWEEP_CELL_KM = 3.0       # Cell size; roughly the area a 14z viewport returns results for
+SWEEP_PAGES = 3           # Result pages of 20 fetched per cell (start=0, 20, 40)
+SWEEP_WORKERS = 4         # Cells fetched at once
+SWEEP_MAX_CELLS = 400     # Guard against sweeping a whole state by accident
+SWEEP_PROMPT_SHOPS = 25   # Most-reviewed swept shops analyzed; keeps the prompt within PROMPT_TOKEN_BUDGET
+KM_PER_DEGREE_LAT = 110.574
+KM_PER_DEGREE_LNG = 111.320  # At the equator; scaled by cos(latitude)
+INSIGHT_PHRASES = 5       # Praise and complaint phrases listed per shop in --insights mode
+INSIGHT_QUOTES = 1        # Example reviews quoted per sentiment in --insights mode
+INSIGHT_REVIEWS_PER_SHOP = 100  # Reviews fetched per shop in --insights mode; the prompt size does not grow with it
+COMPETITOR_DB = "competitors.sqlite3"  # Shops and reviews kept between runs
+REVIEW_REFRESH_AFTER = 24 * 3600       # Seconds before a shop's stored reviews are checked for new ones
+COMPETITOR_SET_MAX_AGE = 7 * 24 * 3600  # Seconds a location's stored shops are reused instead of searching again
+LLM_OPTIONS = {}  # Extra generation parameters for the LLM, e.g. {"temperature": 0.2}; part of the LLM cache key
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_TTL = 30 * 24 * 3600       # Seconds a cached analysis is reused
+LLM_CACHE_MAX_BYTES = 50 * 1024 * 1024
+LLM_CACHE_EVICTION = "lru"           # "lru" drops the least recently used analyses first, "fifo" the oldest
+DEBUG_PAYLOAD_CHARS = 500  # Characters of API and LLM payloads written to debug.log
+
+class TruncatedJson:
+    """Log argument that serializes only the first `limit` characters of `value`, and only if the record is emitted."""
+    def __init__(self, value, limit=DEBUG_PAYLOAD_CHARS):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        if isinstance(self.value, str):
+            return self.value[:self.limit]
+        parts, size = [], 0
+        for chunk in json.JSONEncoder().iterencode(self.value):
+            parts.append(chunk)
+            size += len(chunk)
+            if size >= self.limit:
+                break
+        return "".join(parts)[:self.limit]
+
+class Metrics:
+    """Thread-safe per-stage timings and counters for one process.
+
+    Spans time a pipeline stage (search, reviews, format, llm, ...) and counters track
+    API calls, cache hits, retries and bytes, labelled by engine. Every finished span is
+    also kept as an event, so a run can be appended to a JSON lines file and compared
+    with earlier runs, or the totals scraped in Prometheus text format.
+    """
+
+    def __init__(self):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.span_counts = defaultdict(int)
+        self.span_seconds = defaultdict(float)
+        self.events = []
+
+    @contextmanager
+    def span(self, stage, **details):
+        """Time the enclosed block as `stage`; details (shop, location, ...) only go into the event."""
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                self.span_counts[(stage, status)] += 1
+                self.span_seconds[(stage, status)] += seconds
+                self.events.append({"run_id": self.run_id, "type": "span", "stage": stage, "status": status,
+                                    "seconds": round(seconds, 6), "at": round(time.time(), 3), **details})
+
+    def clear_events(self):
+        """Drop the span events kept so far; long-running services call this between jobs. Totals are kept."""
+        with self.lock:
+            self.events.clear()
+
+    def count(self, name, value=1, engine=None):
+        with self.lock:
+            self.counters[(name, engine)] += value
+
+    def summary(self):
+        with self.lock:
+            return {
+                "run_id": self.run_id,
+                "type": "summary",
+                "started_at": round(self.started_at, 3),
+                "wall_seconds": round(time.time() - self.started_at, 6),
+                "stages": {
+                    f"{stage}:{status}" if status != "ok" else stage: {"count": count, "seconds": round(self.span_seconds[(stage, status)], 6)}
+                    for (stage, status), count in sorted(self.span_counts.items())
+                },
+                "counters": {
+                    f"{name}:{engine}" if engine else name: value
+                    for (name, engine), value in sorted(self.counters.items(), key=lambda item: (item[0][0], item[0][1] or ""))
+                },
+            }
+
+    def write_jsonl(self, path):
+        """Append this run's span events and a summary line to path."""
+        with self.lock:
+            events = list(self.events)
+        with open(path, "a", encoding="utf-8") as f:
+            for event in events + [self.summary()]:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+    def prometheus_text(self):
+        with self.lock:
+            lines = [
+                "# TYPE predictor_stage_seconds summary",
+                *(f'predictor_stage_seconds_count{{stage="{stage}",status="{status}"}} {count}'
+                  for (stage, status), count in sorted(self.span_counts.items())),
+                *(f'predictor_stage_seconds_sum{{stage="{stage}",status="{status}"}} {seconds:.6f}'
+                  for (stage, status), seconds in sorted(self.span_seconds.items())),
+            ]
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE predictor_{name}_total counter")
+                for (counter, engine), value in self.counters.items():
+                    if counter == name:
+                        labels = f'{{engine="{engine}"}}' if engine else ""
+                        lines.append(f"predictor_{name}_total{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port):
+        """Expose prometheus_text() on http://0.0.0.0:port/metrics from a background thread."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f"Serving metrics on http://localhost:{port}/metrics")
+        return server
+
+metrics = Metrics()
+
+rate_limiter = TokenBucket(REQUESTS_PER_SECOND, REQUESTS_BURST)
+
+http_client = SerpApiClient(pool_size=REVIEW_WORKERS, metrics=metrics, logger=logger)
+
+def serpapi_search(params):
+    """Fetch one SerpApi response through the shared client, waiting for the rate limiter before each attempt."""
+    return http_client.search(params, rate_limiter)
+
+response_cache = ResponseCache(ttls=CACHE_TTLS, metrics=metrics)
 
 def get_search_params(user_input, api_key):
     if "," in user_input and all(part.replace('.', '', 1).replace('-', '', 1).isdigit() for part in user_input.split(',')):
@@ -39,63 +236,734 @@ def get_search_params(user_input, api_key):
 
 def fetch_shops_details(search_params):
     logger.info(f"Sending request to SerpApi for {BUSINESS_TYPE.lower()} search...")
-    response = requests.get("https://serpapi.com/search", params=search_params)
-    data = response.json()
-    logger.debug(f"Received response: {json.dumps(data)[:500]}")
+    with metrics.span("search", query=search_params.get("q"), ll=search_params.get("ll")):
+        data = response_cache.search(search_params, serpapi_search)
+    logger.debug("Received response: %s", TruncatedJson(data))
     logger.info(f"Received response from SerpAPI.")
     local_results = data.get("local_results", [])
     logger.info(f"Found {len(local_results)} {BUSINESS_TYPE.lower()}s around the area.")
     return local_results
 
-def fetch_reviews(data_id, shop_title):
+async def afetch_shops_details(search_params, client):
+    """Async variant of fetch_shops_details using an AsyncSerpApiClient."""
+    logger.info(f"Sending request to SerpApi for {BUSINESS_TYPE.lower()} search...")
+    with metrics.span("search", query=search_params.get("q"), ll=search_params.get("ll")):
+        data = await response_cache.asearch(search_params, client.search)
+    logger.debug("Received response: %s", TruncatedJson(data))
+    local_results = data.get("local_results", [])
+    logger.info(f"Found {len(local_results)} {BUSINESS_TYPE.lower()}s around the area.")
+    return local_results
+
+def parse_bbox(text):
+    """Parse "south,west,north,east" into floats."""
+    south, west, north, east = (float(part) for part in text.split(","))
+    if south >= north or west >= east:
+        raise ValueError(f"Bounding box must be south,west,north,east: {text}")
+    return south, west, north, east
+
+def parse_radius(text):
+    """Parse "lat,lng,km" into floats."""
+    lat, lng, radius_km = (float(part) for part in text.split(","))
+    if radius_km <= 0:
+        raise ValueError(f"Radius must be positive: {text}")
+    return lat, lng, radius_km
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """Equirectangular approximation; accurate to well under 1% at city scale."""
+    x = math.radians(lng2 - lng1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return 6371.0 * math.hypot(x, y)
+
+def bbox_around(lat, lng, radius_km):
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    dlng = radius_km / (KM_PER_DEGREE_LNG * math.cos(math.radians(lat)))
+    return lat - dlat, lng - dlng, lat + dlat, lng + dlng
+
+def grid_cells(south, west, north, east, cell_km=SWEEP_CELL_KM):
+    """Centers of the cell_km x cell_km cells tiling the bounding box, row by row from the south-west."""
+    rows = max(1, math.ceil((north - south) * KM_PER_DEGREE_LAT / cell_km))
+    dlat = (north - south) / rows
+    cells = []
+    for row in range(rows):
+        lat = south + (row + 0.5) * dlat
+        columns = max(1, math.ceil((east - west) * KM_PER_DEGREE_LNG * math.cos(math.radians(lat)) / cell_km))
+        dlng = (east - west) / columns
+        cells.extend((round(lat, 6), round(west + (column + 0.5) * dlng, 6)) for column in range(columns))
+    return cells
+
+def radius_cells(lat, lng, radius_km, cell_km=SWEEP_CELL_KM):
+    """Grid cells of the radius's bounding box that overlap the circle."""
+    half_diagonal = cell_km / math.sqrt(2)
+    return [cell for cell in grid_cells(*bbox_around(lat, lng, radius_km), cell_km)
+            if distance_km(lat, lng, *cell) <= radius_km + half_diagonal]
+
+class ShopIndex:
+    """Shops merged from overlapping grid cells, deduplicated by data_id.
+
+    Shops are also bucketed into a coarse lat/lng grid, so shops without a data_id are
+    matched against nearby shops of the same name, and radius queries only scan the
+    buckets that can contain hits.
+    """
+    def __init__(self, bucket_km=0.5):
+        self.bucket_deg = bucket_km / KM_PER_DEGREE_LAT
+        self.shops = {}
+        self.buckets = defaultdict(list)
+
+    def _bucket(self, lat, lng):
+        return int(math.floor(lat / self.bucket_deg)), int(math.floor(lng / self.bucket_deg))
+
+    @staticmethod
+    def _position(shop):
+        coordinates = shop.get("gps_coordinates")
+        if isinstance(coordinates, dict) and "latitude" in coordinates and "longitude" in coordinates:
+            return coordinates["latitude"], coordinates["longitude"]
+        return None
+
+    def _nearby_keys(self, lat, lng, radius_km):
+        lat_buckets = math.ceil(radius_km / (self.bucket_deg * KM_PER_DEGREE_LAT))
+        lng_buckets = math.ceil(radius_km / (self.bucket_deg * KM_PER_DEGREE_LNG * max(math.cos(math.radians(lat)), 0.01)))
+        row, column = self._bucket(lat, lng)
+        for dr in range(-lat_buckets, lat_buckets + 1):
+            for dc in range(-lng_buckets, lng_buckets + 1):
+                yield from self.buckets.get((row + dr, column + dc), ())
+
+    def add(self, shop):
+        """Add a shop; returns False if it is already indexed."""
+        position = self._position(shop)
+        key = shop.get("data_id")
+        if key is None:
+            if position is None:
+                key = f"title:{shop.get('title')}|{shop.get('address')}"
+            else:
+                title = shop.get("title")
+                for other in self._nearby_keys(*position, 0.05):
+                    if self.shops[other].get("title") == title:
+                        return False
+                key = f"title:{title}|{position[0]:.5f},{position[1]:.5f}"
+        if key in self.shops:
+            return False
+        self.shops[key] = shop
+        if position is not None:
+            self.buckets[self._bucket(*position)].append(key)
+        return True
+
+    def within(self, lat, lng, radius_km):
+        """Shops with coordinates within radius_km of (lat, lng)."""
+        return [self.shops[key] for key in self._nearby_keys(lat, lng, radius_km)
+                if distance_km(lat, lng, *self._position(self.shops[key])) <= radius_km]
+
+    def inside(self, south, west, north, east):
+        """Shops with coordinates inside the bounding box."""
+        return [shop for shop in self.shops.values()
+                if (position := self._position(shop)) is not None
+                and south <= position[0] <= north and west <= position[1] <= east]
+
+def fetch_cell_shops(lat, lng, api_key, zoom=SWEEP_ZOOM, pages=SWEEP_PAGES):
+    """Fetch up to `pages` pages of 20 shops around one grid cell center."""
+    shops = []
+    for page in range(pages):
+        params = get_search_params(f"{lat},{lng}", api_key)
+        params["ll"] = f"@{lat},{lng},{zoom}z"
+        if page:
+            params["start"] = page * 20
+        local_results = fetch_shops_details(params)
+        shops.extend(local_results)
+        if len(local_results) < 20:
+            break
+    return shops
+
+def sweep_shops(cells, api_key, max_workers=SWEEP_WORKERS, zoom=SWEEP_ZOOM, pages=SWEEP_PAGES):
+    """Fetch every grid cell concurrently and merge the shops into a ShopIndex."""
+    if len(cells) > SWEEP_MAX_CELLS:
+        raise ValueError(f"Sweep would search {len(cells)} cells (limit {SWEEP_MAX_CELLS}); use a smaller area or larger SWEEP_CELL_KM")
+    logger.info(f"Sweeping {len(cells)} grid cells, up to {pages} pages each")
+    index = ShopIndex()
+    fetched = 0
+    with metrics.span("sweep", cells=len(cells)), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for shops in executor.map(lambda cell: fetch_cell_shops(*cell, api_key, zoom, pages), cells):
+            fetched += len(shops)
+            for shop in shops:
+                index.add(shop)
+    logger.info(f"Sweep found {len(index.shops)} unique {BUSINESS_TYPE.lower()}s in {fetched} results")
+    return index
+
+def sweep_area(api_key, bbox=None, radius=None, max_workers=SWEEP_WORKERS):
+    """Shops inside a "south,west,north,east" bounding box or a "lat,lng,km" radius."""
+    if radius:
+        lat, lng, radius_km = parse_radius(radius)
+        return sweep_shops(radius_cells(lat, lng, radius_km), api_key, max_workers).within(lat, lng, radius_km)
+    south, west, north, east = parse_bbox(bbox)
+    return sweep_shops(grid_cells(south, west, north, east), api_key, max_workers).inside(south, west, north, east)
+
+def most_reviewed(shops, limit=SWEEP_PROMPT_SHOPS):
+    """The `limit` shops with the most reviews, most reviewed first; ties keep their order."""
+    if len(shops) > limit:
+        logger.info(f"Analyzing the {limit} most reviewed of {len(shops)} {BUSINESS_TYPE.lower()}s")
+    return sorted(shops, key=lambda shop: shop.get("reviews") or 0, reverse=True)[:limit]
+
+def iter_reviews(data_id, shop_title, max_reviews=REVIEWS_PER_SHOP, sort_by=None):
+    """Yield reviews for a shop page by page, following next_page_token until max_reviews is reached.
+
+    sort_by="newestFirst" returns the most recent reviews first instead of the most relevant.
+    """
     logger.info(f"Fetching reviews for: {data_id} ({shop_title})")
-    review_params = {
+    review_params = reviews_search_params(data_id, sort_by)
+    count = 0
+    while count < max_reviews:
+        review_results = response_cache.search(review_params, serpapi_search)
+        reviews = review_results.get("reviews", [])
+        for review in reviews[:max_reviews - count]:
+            count += 1
+            yield parse_review(review)
+        review_params = next_reviews_params(review_params, review_results)
+        if not reviews or review_params is None:
+            break
+    logger.info(f"Found {count} reviews for shop {shop_title}")
+
+async def aiter_reviews(data_id, shop_title, client, max_reviews=REVIEWS_PER_SHOP, sort_by=None):
+    """Async variant of iter_reviews using an AsyncSerpApiClient."""
+    logger.info(f"Fetching reviews for: {data_id} ({shop_title})")
+    review_params = reviews_search_params(data_id, sort_by)
+    count = 0
+    while count < max_reviews:
+        review_results = await response_cache.asearch(review_params, client.search)
+        reviews = review_results.get("reviews", [])
+        for review in reviews[:max_reviews - count]:
+            count += 1
+            yield parse_review(review)
+        review_params = next_reviews_params(review_params, review_results)
+        if not reviews or review_params is None:
+            break
+    logger.info(f"Found {count} reviews for shop {shop_title}")
+
+def reviews_search_params(data_id, sort_by=None):
+    params = {
         "api_key": os.getenv("SERPAPI_API_KEY"),
         "engine": "google_maps_reviews",
         "data_id": data_id,
         "hl": "en"
     }
-    review_search = GoogleSearch(review_params)
-    review_results = review_search.get_dict()
-    reviews = review_results.get("reviews", [])
-    logger.info(f"Found {len(reviews)} reviews for shop {shop_title}")
-    time.sleep(1)
-    return [
-        {
-            "review_text": review.get("snippet"),
-            "review_star_rating": review.get("rating"),
-            "timestamp": review.get("date")
-        }
-        for review in reviews
-    ]
+    if sort_by:
+        params["sort_by"] = sort_by
+    return params
+
+def next_reviews_params(params, review_results):
+    """Params for the page after review_results, or None on the last page."""
+    next_page_token = review_results.get("serpapi_pagination", {}).get("next_page_token")
+    if not next_page_token:
+        return None
+    # Pages after the first accept up to 20 reviews each
+    return {**params, "next_page_token": next_page_token, "num": 20}
+
+def parse_review(review):
+    return {
+        "review_text": review.get("snippet"),
+        "review_star_rating": review.get("rating"),
+        "timestamp": review.get("date"),
+        "review_id": review.get("review_id"),
+        "iso_date": review.get("iso_date")
+    }
+
+class JsonlSink:
+    """Thread-safe writer that appends one JSON record per line and flushes as records arrive."""
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+        if self.file.tell():
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.file.write("\n")  # End a line cut off by a crash, so the next record starts on its own line
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def fetch_reviews(data_id, shop_title, max_reviews=REVIEWS_PER_SHOP, sink=None, store=None):
+    reviews = []
+    with metrics.span("reviews", data_id=data_id, shop=shop_title):
+        source = refresh_reviews(store, data_id, shop_title, max_reviews) if store else iter_reviews(data_id, shop_title, max_reviews)
+        for review in source:
+            if sink is not None:
+                sink.write({"data_id": data_id, "business_name": shop_title, **review})
+            reviews.append(review)
+    metrics.count("reviews_fetched", len(reviews))
+    return reviews
+
+class CompetitorStore:
+    """SQLite store of competitor shops and their reviews, keyed by data_id.
+
+    `shops` holds the latest listing of each shop, when its reviews were last fetched and
+    whether that fetch reached the shop's last review page (reviews_exhausted),
+    `reviews` every review seen so far (seq orders them, newest highest) and
+    `competitor_sets` which shops each searched location returned. Repeat runs reuse a
+    location's shops for set_max_age seconds and only fetch reviews newer than the newest
+    stored one; see refresh_reviews.
+    """
+
+    def __init__(self, path=COMPETITOR_DB, refresh_after=REVIEW_REFRESH_AFTER, set_max_age=COMPETITOR_SET_MAX_AGE):
+        self.path = path
+        self.refresh_after = refresh_after
+        self.set_max_age = set_max_age
+        self.lock = threading.Lock()
+        self.created = False  # Tables are created on first use, so importing this module creates no file
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                if not self.created:
+                    self._create_tables(conn)
+                    self.created = True
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _create_tables(conn):
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS shops (
+                data_id TEXT PRIMARY KEY, title TEXT, listing TEXT,
+                first_seen REAL, last_seen REAL, reviews_fetched_at REAL,
+                reviews_exhausted INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS reviews (
+                data_id TEXT, review_id TEXT, seq INTEGER, body TEXT, fetched_at REAL,
+                PRIMARY KEY (data_id, review_id)
+            );
+            CREATE INDEX IF NOT EXISTS reviews_by_shop ON reviews (data_id, seq);
+            CREATE TABLE IF NOT EXISTS competitor_sets (
+                location TEXT, data_id TEXT, seen_at REAL,
+                PRIMARY KEY (location, data_id)
+            );
+        """)
+        try:
+            conn.execute("ALTER TABLE shops ADD COLUMN reviews_exhausted INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass  # Created above, or by an earlier run; stores from before the column get it here
+
+    def save_shops(self, location, local_results):
+        """Store the shops and make them, in their search order, the competitor set of location."""
+        timestamp = time.time()
+        rows = [(shop["data_id"], shop.get("title"), json.dumps(shop), timestamp, timestamp)
+                for shop in local_results if shop.get("data_id")]
+        with self.lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO shops (data_id, title, listing, first_seen, last_seen) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (data_id) DO UPDATE SET title = excluded.title, listing = excluded.listing, last_seen = excluded.last_seen",
+                rows
+            )
+            conn.execute("DELETE FROM competitor_sets WHERE location = ?", (location,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO competitor_sets VALUES (?, ?, ?)",
+                [(location, row[0], timestamp) for row in rows]
+            )
+
+    def competitor_set(self, location):
+        """Listings of the shops last saved for location in search order, or [] once older than set_max_age."""
+        with self.lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT shops.listing FROM competitor_sets JOIN shops USING (data_id) "
+                "WHERE location = ? AND seen_at >= ? ORDER BY competitor_sets.rowid",
+                (location, time.time() - self.set_max_age)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def review_state(self, data_id):
+        """(reviews_fetched_at or None, whether that fetch ran out of review pages, number of stored reviews)"""
+        with self.lock, self._connect() as conn:
+            row = conn.execute("SELECT reviews_fetched_at, reviews_exhausted FROM shops WHERE data_id = ?", (data_id,)).fetchone()
+            stored = conn.execute("SELECT COUNT(*) FROM reviews WHERE data_id = ?", (data_id,)).fetchone()[0]
+        fetched_at, exhausted = row or (None, 0)
+        return fetched_at, bool(exhausted), stored
+
+    def known_review_ids(self, data_id):
+        with self.lock, self._connect() as conn:
+            return {row[0] for row in conn.execute("SELECT review_id FROM reviews WHERE data_id = ?", (data_id,))}
+
+    def add_reviews(self, data_id, reviews, older=(), exhausted=False):
+        """Store reviews given newest first, and mark the shop's reviews as fetched now.
+
+        `reviews` are newer than every stored review, `older` (also newest first) older than every one.
+        exhausted records that the fetch reached the shop's last review page.
+        """
+        timestamp = time.time()
+        with self.lock, self._connect() as conn:
+            top, bottom = conn.execute(
+                "SELECT COALESCE(MAX(seq), 0), COALESCE(MIN(seq), 1) FROM reviews WHERE data_id = ?", (data_id,)
+            ).fetchone()
+            rows = [(data_id, review["review_id"], top + len(reviews) - i, json.dumps(review), timestamp)
+                    for i, review in enumerate(reviews)]
+            rows += [(data_id, review["review_id"], bottom - 1 - i, json.dumps(review), timestamp)
+                     for i, review in enumerate(older)]
+            conn.executemany("INSERT OR IGNORE INTO reviews VALUES (?, ?, ?, ?, ?)", [row for row in rows if row[1]])
+            conn.execute("INSERT OR IGNORE INTO shops (data_id, first_seen, last_seen) VALUES (?, ?, ?)", (data_id, timestamp, timestamp))
+            conn.execute("UPDATE shops SET reviews_fetched_at = ?, reviews_exhausted = ? WHERE data_id = ?",
+                         (timestamp, int(exhausted), data_id))
+
+    def stored_reviews(self, data_id, limit):
+        """The newest `limit` stored reviews; relative dates ("3 weeks ago") are replaced by the review date."""
+        with self.lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT body FROM reviews WHERE data_id = ? ORDER BY seq DESC LIMIT ?", (data_id, limit)
+            ).fetchall()
+        reviews = [json.loads(row[0]) for row in rows]
+        for review in reviews:
+            if review.get("iso_date"):
+                review["timestamp"] = review["iso_date"][:10]
+        return reviews
+
+def refresh_reviews(store, data_id, shop_title, max_reviews=REVIEWS_PER_SHOP):
+    """Return a shop's newest reviews from the store, fetching only the ones added since the last run.
+
+    Reviews are requested newest first and pagination stops at the first review already
+    stored. Shops refreshed less than store.refresh_after seconds ago make no request.
+    When fewer than max_reviews are stored, for example after raising the budget for
+    --insights, paging continues past the stored reviews and the older ones are added too.
+    A shop whose last refresh ran out of review pages has no more to add, so it also makes
+    no request until refresh_after has passed, however few reviews it has.
+    """
+    fetched_at, exhausted, stored = store.review_state(data_id)
+    if fetched_at is not None and time.time() - fetched_at < store.refresh_after and (stored >= max_reviews or exhausted):
+        metrics.count("store_fresh_shops")
+    else:
+        known = store.known_review_ids(data_id)
+        new_reviews, older_reviews = [], []
+        past_known = False
+        exhausted = False
+        seen = 0
+        for review in iter_reviews(data_id, shop_title, max_reviews, sort_by="newestFirst"):
+            if review["review_id"] in known:
+                if stored >= max_reviews:
+                    break
+                past_known = True
+            else:
+                (older_reviews if past_known else new_reviews).append(review)
+            seen += 1
+        else:
+            exhausted = seen < max_reviews  # iter_reviews stopped short of the budget: no pages left
+        store.add_reviews(data_id, new_reviews, older_reviews, exhausted)
+        metrics.count("store_new_reviews", len(new_reviews) + len(older_reviews))
+        logger.info(f"Stored {len(new_reviews) + len(older_reviews)} new reviews for shop {shop_title}")
+    return store.stored_reviews(data_id, max_reviews)
+
+def harvest_reviews(local_results, sink_path, max_reviews=HARVEST_REVIEW_BUDGET, max_workers=REVIEW_WORKERS):
+    """Stream up to max_reviews reviews per shop into a JSONL file without keeping them in memory."""
+    def harvest(shop):
+        count = 0
+        for review in iter_reviews(shop["data_id"], shop.get("title"), max_reviews):
+            sink.write({"data_id": shop["data_id"], "business_name": shop.get("title"), **review})
+            count += 1
+        return count
 
-def build_competitor_data(local_results):
+    with JsonlSink(sink_path) as sink, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        total = sum(executor.map(harvest, [shop for shop in local_results if shop.get("data_id")]))
+    logger.info(f"Harvested {total} reviews into {sink_path}")
+    return total
+
+def shop_details(shop):
+    return {
+        "business_name": shop.get("title"),
+        "address": shop.get("address"),
+        "GPS_coordinates": shop.get("gps_coordinates", "Not available"),
+        "star_rating": shop.get("rating"),
+        "review_count": shop.get("reviews"),
+        "opening_hours": shop.get("operating_hours", "Not available"),
+        "price_level": shop.get("price", "Not available"),
+        "customer_reviews": []
+    }
+
+def build_competitor_data(local_results, max_workers=REVIEW_WORKERS, max_reviews=REVIEWS_PER_SHOP, sink=None, store=None):
     competitors = []
+    pending_reviews = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for shop in local_results:
+            logger.info(f"Processing shop: {shop.get('title')}")
+            shop_info = shop_details(shop)
+            data_id = shop.get("data_id")
+            if data_id:
+                pending_reviews[len(competitors)] = executor.submit(fetch_reviews, data_id, shop.get("title"), max_reviews, sink, store)
+            competitors.append(shop_info)
+        for index, future in pending_reviews.items():
+            competitors[index]["customer_reviews"] = future.result()
+    return competitors
+
+async def afetch_reviews(data_id, shop_title, client, max_reviews=REVIEWS_PER_SHOP):
+    with metrics.span("reviews", data_id=data_id, shop=shop_title):
+        reviews = [review async for review in aiter_reviews(data_id, shop_title, client, max_reviews)]
+    metrics.count("reviews_fetched", len(reviews))
+    return reviews
+
+async def aiter_competitors(local_results, client, max_reviews=REVIEWS_PER_SHOP):
+    """Async variant of build_competitor_data that yields each shop's record, in order, once its reviews are in.
+
+    Reviews of every shop are requested at once; the client's max_concurrency and rate
+    limit decide how many requests are actually in flight.
+    """
+    pending = []
     for shop in local_results:
-        logger.info(f"Processing shop: {shop.get('title')}")
-        shop_info = {
-            "business_name": shop.get("title"),
-            "address": shop.get("address"),
-            "GPS_coordinates": shop.get("gps_coordinates", "Not available"),
-            "star_rating": shop.get("rating"),
-            "review_count": shop.get("reviews"),
-            "opening_hours": shop.get("operating_hours", "Not available"),
-            "price_level": shop.get("price", "Not available"),
-            "customer_reviews": []
-        }
         data_id = shop.get("data_id")
-        if data_id:
-            shop_info["customer_reviews"] = fetch_reviews(data_id, shop.get("title"))
-        competitors.append(shop_info)
-    return competitors
+        task = asyncio.ensure_future(afetch_reviews(data_id, shop.get("title"), client, max_reviews)) if data_id else None
+        pending.append((shop_details(shop), task))
+    try:
+        for shop_info, task in pending:
+            if task is not None:
+                shop_info["customer_reviews"] = await task
+            yield shop_info
+    finally:
+        for _, task in pending:
+            if task is not None:
+                task.cancel()
+
+async def agather_competitors(user_input, api_key, client=None, max_reviews=REVIEWS_PER_SHOP):
+    """Async variant of gather_competitors: yields competitor records for a location name or "lat,lng".
+
+    Pass a shared AsyncSerpApiClient to run many locations on one connection pool and
+    rate limit; one is opened for this call otherwise.
+    """
+    if client is None:
+        async with AsyncSerpApiClient(rate=REQUESTS_PER_SECOND, burst=REQUESTS_BURST, metrics=metrics, logger=logger) as client:
+            async for shop_info in agather_competitors(user_input, api_key, client, max_reviews):
+                yield shop_info
+        return
+    local_results = await afetch_shops_details(get_search_params(user_input, api_key), client)
+    async for shop_info in aiter_competitors(local_results, client, max_reviews):
+        yield shop_info
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN
+
+def normalize_review_text(text):
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", (text or "").lower()).split())
+
+def select_reviews(reviews):
+    """Drop near-duplicate reviews and order the rest round-robin across star ratings,
+    so a truncated list still covers both praise and complaints."""
+    seen = set()
+    by_rating = {}
+    for review in reviews:
+        key = normalize_review_text(review["review_text"])
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        by_rating.setdefault(review["review_star_rating"], []).append(review)
+    buckets = [iter(by_rating[rating]) for rating in sorted(by_rating, key=lambda r: (r is None, r))]
+    selected = []
+    while buckets:
+        for bucket in list(buckets):
+            review = next(bucket, None)
+            if review is None:
+                buckets.remove(bucket)
+            else:
+                selected.append(review)
+    return selected
+
+def format_review(review):
+    text = (review["review_text"] or "").replace("\n", " ")
+    if len(text) > MAX_REVIEW_CHARS:
+        text = text[:MAX_REVIEW_CHARS].rstrip() + "..."
+    return f"    - \"{text}\" | {review['review_star_rating']} stars | {review['timestamp']}\n"
+
+def format_shop_details(shop):
+    return f"\n- {shop['business_name']}\n  - Address: {shop['address']}\n  - GPS: {shop['GPS_coordinates']}\n  - Star Rating: {shop['star_rating']}\n  - Review Count: {shop['review_count']}\n  - Opening Hours: {shop['opening_hours']}\n  - Price Level: {shop['price_level']}\n"
+
+def format_competitor_data(competitors, token_budget=PROMPT_TOKEN_BUDGET):
+    """Format competitor data for the prompt, fitting reviews into roughly token_budget tokens.
+
+    Shop details are always included; the remaining budget is split evenly between shops
+    and filled with deduplicated reviews.
+    """
+    headers = [format_shop_details(shop) + "  - Customer Reviews:\n" for shop in competitors]
+    review_chars = token_budget * CHARS_PER_TOKEN - sum(len(header) for header in headers)
+    chars_per_shop = max(review_chars, 0) // max(len(competitors), 1)
+    parts = []
+    omitted = 0
+    for shop, header in zip(competitors, headers):
+        parts.append(header)
+        remaining = chars_per_shop
+        for review in select_reviews(shop["customer_reviews"]):
+            line = format_review(review)
+            if len(line) > remaining:
+                omitted += 1
+                continue
+            parts.append(line)
+            remaining -= len(line)
+    if omitted:
+        logger.info(f"Left {omitted} reviews out of the prompt to stay within ~{token_budget} tokens")
+    return "".join(parts)
+
+# Small review lexicon; words are matched after normalize_review_text (lowercase, no punctuation)
+POSITIVE_WORDS = frozenset("""
+    amazing awesome beautiful best cozy cosy clean comfortable cute delicious excellent fantastic fast favorite
+    favourite fresh friendly good great helpful incredible kind love loved lovely nice perfect pleasant polite
+    quick quiet recommend relaxing smooth spacious strong sweet tasty welcoming wonderful worth yummy
+""".split())
+NEGATIVE_WORDS = frozenset("""
+    awful bad bitter bland broken burnt cold crowded dirty disappointed disappointing expensive filthy gross
+    horrible lukewarm loud mediocre messy meh noisy overpriced poor rude slow small sour stale terrible
+    unfriendly unprofessional wait waited waiting watery weak worst wrong
+""".split())
+NEGATIONS = frozenset("not no never hardly without isn wasn aren weren don didn doesn couldn wouldn won".split())
+STOPWORDS = frozenset("""
+    a about after all also am an and any are as at be been but by can coffee could did do for from get got had
+    has have here i if in is it its just me more my of on one or our out place really shop so some than that the
+    their them there they this to too us very was we went were what when which while will with would you your
+""".split()) | NEGATIONS
+
+def score_review(tokens):
+    """Lexicon sentiment in [-1, 1]; a negation flips the next three words."""
+    positive = negative = 0
+    negate_until = -1
+    for i, token in enumerate(tokens):
+        if token in NEGATIONS:
+            negate_until = i + 3
+            continue
+        polarity = (token in POSITIVE_WORDS) - (token in NEGATIVE_WORDS)
+        if polarity and i <= negate_until:
+            polarity = -polarity
+        if polarity > 0:
+            positive += 1
+        elif polarity < 0:
+            negative += 1
+    return (positive - negative) / max(positive + negative, 1)
+
+def review_phrases(tokens):
+    """Distinct content words and two-word phrases of one review."""
+    words = [token if token not in STOPWORDS and len(token) > 2 else None for token in tokens]
+    phrases = {word for word in words if word}
+    phrases.update(f"{first} {second}" for first, second in zip(words, words[1:]) if first and second)
+    return phrases
+
+def top_phrases(counts, other_counts, limit=INSIGHT_PHRASES):
+    """Phrases most specific to one sentiment: frequent in counts, rarer in other_counts.
+    Two-word phrases win ties, and single words already covered by a listed phrase are skipped."""
+    ranked = sorted(
+        (phrase for phrase, count in counts.items() if count > other_counts.get(phrase, 0)),
+        key=lambda phrase: (-(counts[phrase] - other_counts.get(phrase, 0)), -phrase.count(" "), phrase)
+    )
+    selected = []
+    for phrase in ranked:
+        if any(phrase in chosen.split() for chosen in selected):
+            continue
+        selected.append(phrase)
+        if len(selected) == limit:
+            break
+    return [(phrase, counts[phrase]) for phrase in selected]
+
+class ReviewStats:
+    """Sentiment, rating and phrase statistics accumulated over reviews, computed locally.
+
+    Per-shop stats can be merged with update(), so market-wide totals need no second pass.
+    """
+    def __init__(self):
+        self.reviews = 0
+        self.histogram = Counter()
+        self.sentiment = Counter()
+        self.praise = Counter()
+        self.complaints = Counter()
+        self.total_score = 0.0
+        self.quotes = {"positive": [], "negative": []}
+
+    def add(self, review):
+        self.reviews += 1
+        rating = review.get("review_star_rating")
+        if rating is not None:
+            self.histogram[int(round(rating))] += 1
+        tokens = normalize_review_text(review.get("review_text")).split()
+        if not tokens:
+            return
+        score = score_review(tokens)
+        self.total_score += score
+        label = "positive" if score > 0 else "negative" if score < 0 else "neutral"
+        self.sentiment[label] += 1
+        if label != "neutral":
+            (self.praise if label == "positive" else self.complaints).update(review_phrases(tokens))
+            # Keep the strongest, then shortest, reviews of each sentiment as examples
+            candidates = self.quotes[label]
+            candidates.append((-abs(score), len(tokens), len(candidates), review))
+            if len(candidates) > 4 * INSIGHT_QUOTES:
+                candidates.sort(key=lambda c: c[:3])
+                del candidates[INSIGHT_QUOTES:]
+
+    def update(self, other):
+        self.reviews += other.reviews
+        self.histogram.update(other.histogram)
+        self.sentiment.update(other.sentiment)
+        self.praise.update(other.praise)
+        self.complaints.update(other.complaints)
+        self.total_score += other.total_score
+        for label, candidates in other.quotes.items():
+            self.quotes[label].extend(candidates)
+
+    def summary(self):
+        scored = sum(self.sentiment.values())
+        rated = sum(self.histogram.values())
+        return {
+            "reviews": self.reviews,
+            "rating_histogram": {stars: self.histogram.get(stars, 0) for stars in range(5, 0, -1)},
+            "mean_rating": round(sum(stars * count for stars, count in self.histogram.items()) / rated, 2) if rated else None,
+            "sentiment": {label: self.sentiment.get(label, 0) for label in ("positive", "neutral", "negative")},
+            "sentiment_score": round(self.total_score / scored, 2) if scored else None,
+            "praise": top_phrases(self.praise, self.complaints),
+            "complaints": top_phrases(self.complaints, self.praise),
+            "quotes": {label: [c[3] for c in sorted(candidates, key=lambda c: c[:2])[:INSIGHT_QUOTES]]
+                       for label, candidates in self.quotes.items()},
+        }
+
+def analyze_reviews(reviews):
+    stats = ReviewStats()
+    for review in reviews:
+        stats.add(review)
+    return stats
+
+def format_review_insights(insights):
+    if not insights["reviews"]:
+        return "  - Review Insights: no reviews fetched\n"
+    sentiment = insights["sentiment"]
+    scored = max(sum(sentiment.values()), 1)
+    lines = [
+        f"  - Review Insights ({insights['reviews']} reviews):\n",
+        "    - Ratings: " + ", ".join(f"{stars}★ {count}" for stars, count in insights["rating_histogram"].items())
+        + f" (mean {insights['mean_rating']})\n",
+        "    - Sentiment: " + ", ".join(f"{count * 100 // scored}% {label}" for label, count in sentiment.items())
+        + f" (score {insights['sentiment_score']})\n",
+        "    - Praised: " + (", ".join(f"{phrase} ({count})" for phrase, count in insights["praise"]) or "nothing recurring") + "\n",
+        "    - Complaints: " + (", ".join(f"{phrase} ({count})" for phrase, count in insights["complaints"]) or "nothing recurring") + "\n",
+    ]
+    for label in ("positive", "negative"):
+        lines.extend(format_review(review).replace("    - ", f"    - Example {label}: ", 1) for review in insights["quotes"][label])
+    return "".join(lines)
+
+def format_competitor_insights(competitors):
+    """Format competitor data with locally pre-computed review statistics instead of raw reviews.
 
-def format_competitor_data(competitors):
-    competitor_data_str = ""
-    for shop in competitors:
-        competitor_data_str += f"\n- {shop['business_name']}\n  - Address: {shop['address']}\n  - GPS: {shop['GPS_coordinates']}\n  - Star Rating: {shop['star_rating']}\n  - Review Count: {shop['review_count']}\n  - Opening Hours: {shop['opening_hours']}\n  - Price Level: {shop['price_level']}\n  - Customer Reviews:\n"
-        for review in shop["customer_reviews"]:
-            competitor_data_str += f"    - \"{review['review_text']}\" | {review['review_star_rating']} stars | {review['timestamp']}\n"
-    return competitor_data_str
+    The prompt grows with the number of shops but not with the number of reviews per shop.
+    """
+    with metrics.span("insights", competitors=len(competitors)):
+        market = ReviewStats()
+        parts = []
+        for shop in competitors:
+            stats = analyze_reviews(shop["customer_reviews"])
+            market.update(stats)
+            parts.append(format_shop_details(shop))
+            parts.append(format_review_insights(stats.summary()))
+        parts.append("\n- All competitors combined\n")
+        parts.append(format_review_insights(market.summary()))
+    header = (f"(Review statistics below were computed locally over all {market.reviews} fetched reviews "
+              "with a word lexicon; treat them as the sentiment analysis and quote phrases from them.)\n")
+    return header + "".join(parts)
 
 def build_prompt(competitor_data_str):
     return f"""
@@ -153,11 +1021,317 @@ def build_prompt(competitor_data_str):
 def now():
     return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
+def create_llm_client():
+    return OpenAI(
+        base_url=LLM_BASE_URL,
+        api_key="ollama"                       # Dummy key
+    )
+
+llm_cache = ResponseCache(path=LLM_CACHE_PATH, default_ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_MAX_BYTES, eviction=LLM_CACHE_EVICTION)
+llm_cache_locks = {}  # Prompt key -> [lock, waiting callers], so identical concurrent prompts run once
+llm_cache_locks_guard = threading.Lock()
+
+def generate_analysis(client, prompt, stream=False, outputs=()):
+    """Run the prompt through the LLM. With stream=True, tokens are written to each
+    file-like object in outputs as they arrive.
+
+    Outputs are cached in llm_cache under a hash of the model, prompt and LLM_OPTIONS, so an
+    identical prompt is answered from the cache (and written to outputs in one go).
+    """
+    if llm_cache is None:
+        return complete_prompt(client, prompt, stream, outputs)
+    key = llm_cache.make_key({"model": LLM_MODEL, "prompt": prompt, "options": json.dumps(LLM_OPTIONS, sort_keys=True)})
+    with llm_cache_locks_guard:
+        entry = llm_cache_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            cached = llm_cache.get(key, "llm")
+            if cached is not None:
+                metrics.count("cache_hits", engine="llm")
+                logger.info(f"Reusing cached {LLM_MODEL} response for an identical prompt")
+                for output in outputs:
+                    output.write(cached["content"])
+                    output.flush()
+                return cached["content"]
+            metrics.count("cache_misses", engine="llm")
+            ai_output = complete_prompt(client, prompt, stream, outputs)
+            llm_cache.set(key, {"model": LLM_MODEL, "content": ai_output}, "llm")
+        return ai_output
+    finally:
+        with llm_cache_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del llm_cache_locks[key]  # The last caller removes the lock, so the dict only holds prompts in flight
+
+def complete_prompt(client, prompt, stream=False, outputs=()):
+    metrics.count("llm_calls")
+    with metrics.span("llm", model=LLM_MODEL, stream=stream, prompt_tokens_estimate=estimate_tokens(prompt)):
+        response = client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            stream=stream,
+            **LLM_OPTIONS
+        )
+        if stream:
+            parts = []
+            for chunk in response:
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content or ""
+                parts.append(token)
+                for output in outputs:
+                    output.write(token)
+                    output.flush()
+            ai_output = "".join(parts)
+        else:
+            ai_output = response.choices[0].message.content
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                metrics.count("llm_prompt_tokens", usage.prompt_tokens or 0)
+                metrics.count("llm_completion_tokens", usage.completion_tokens or 0)
+    logger.debug("AI response: %s", TruncatedJson(ai_output))
+    return ai_output
+
+NO_REVIEWS_SUMMARY = "- No customer reviews available."
+
+def summarize_competitor(client, shop):
+    reviews = "".join(format_review(review) for review in select_reviews(shop["customer_reviews"]))
+    if not reviews:
+        return NO_REVIEWS_SUMMARY  # Nothing for the LLM to summarize
+    prompt = (
+        f"Summarize these customer reviews of the {BUSINESS_TYPE.lower()} \"{shop['business_name']}\" in at most 5 short bullet points. "
+        "Cover overall sentiment, recurring praise, recurring complaints and unmet needs. Reply with the bullets only.\n\n"
+        f"{reviews}"
+    )
+    return generate_analysis(client, prompt)
+
+def build_map_reduce_prompt(client, competitors, max_workers=LLM_MAP_WORKERS):
+    """Summarize each competitor's reviews in parallel LLM calls (map), then build the final
+    analysis prompt from the short summaries instead of the raw reviews (reduce)."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        summaries = list(executor.map(lambda shop: summarize_competitor(client, shop), competitors))
+    return build_summaries_prompt(competitors, summaries)
+
+def build_summaries_prompt(competitors, summaries):
+    """The reduce step: the analysis prompt built from one review summary per competitor."""
+    competitor_data_str = "".join(
+        format_shop_details(shop) + "  - Review Summary:\n" + "".join(f"    {line}\n" for line in summary.strip().splitlines())
+        for shop, summary in zip(competitors, summaries)
+    )
+    return build_prompt(competitor_data_str)
+
+competitor_store = CompetitorStore()
+
+def gather_competitors(user_input, api_key, area=None, max_reviews=REVIEWS_PER_SHOP):
+    """Competitors around user_input, or in a swept area given as {"bbox": ...} or {"radius": ...}, with up to max_reviews reviews each.
+
+    A sweep can find hundreds of shops, so only the area's "max_shops" (SWEEP_PROMPT_SHOPS)
+    most reviewed ones are kept; every shop header goes into the prompt. The shops of a
+    location searched in the last COMPETITOR_SET_MAX_AGE seconds come from competitor_store.
+    """
+    area = dict(area or {})
+    max_shops = area.pop("max_shops", SWEEP_PROMPT_SHOPS)
+    local_results = competitor_store.competitor_set(user_input) if competitor_store is not None else []
+    if local_results:
+        metrics.count("store_fresh_sets")
+        logger.info(f"Reusing {len(local_results)} stored shops for {user_input}")
+    else:
+        if area:
+            local_results = sweep_area(api_key, **area)
+        else:
+            local_results = fetch_shops_details(get_search_params(user_input, api_key))
+        if competitor_store is not None:
+            competitor_store.save_shops(user_input, local_results)
+    if area:
+        local_results = most_reviewed(local_results, max_shops)
+    return build_competitor_data(local_results, max_reviews=max_reviews, store=competitor_store)
+
+def gather_location(user_input, api_key, area=None, insights=False, max_reviews=None):
+    """Competitors of user_input for the prompt. Without max_reviews, each shop contributes REVIEWS_PER_SHOP
+    reviews, or INSIGHT_REVIEWS_PER_SHOP with insights, whose statistics stay small however many reviews feed them.
+    """
+    if max_reviews is None:
+        max_reviews = INSIGHT_REVIEWS_PER_SHOP if insights else REVIEWS_PER_SHOP
+    with metrics.span("gather", location=user_input):
+        return gather_competitors(user_input, api_key, area, max_reviews)
+
+def prepare_prompt(user_input, api_key, client=None, map_reduce=False, area=None, insights=False, max_reviews=None):
+    competitors = gather_location(user_input, api_key, area, insights, max_reviews)
+    if map_reduce:
+        prompt = build_map_reduce_prompt(client, competitors)
+    elif insights:
+        prompt = build_prompt(format_competitor_insights(competitors))
+    else:
+        with metrics.span("format", location=user_input, competitors=len(competitors)):
+            prompt = build_prompt(format_competitor_data(competitors))
+    logger.info(f"Estimated prompt size: ~{estimate_tokens(prompt)} tokens")
+    return prompt
+
+def read_locations(path):
+    """Read locations from a CSV or JSONL file with a `location` column, or `lat` and `lng` columns."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            records = [json.loads(line) for line in f if line.strip()]
+        else:
+            records = list(csv.DictReader(f))
+    locations = []
+    for record in records:
+        if record.get("location"):
+            locations.append(str(record["location"]).strip())
+        elif record.get("lat") not in (None, "") and record.get("lng") not in (None, ""):
+            locations.append(f"{str(record['lat']).strip()},{str(record['lng']).strip()}")
+        else:
+            logger.warning(f"Skipping record without a location: {record}")
+    return locations
+
+def read_checkpoint(checkpoint_path):
+    """Locations already analyzed; a line cut off by a crash is skipped, so that location runs again."""
+    done = set()
+    if not os.path.exists(checkpoint_path):
+        return done
+    with open(checkpoint_path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                done.add(json.loads(line)["location"])
+            except (ValueError, KeyError, TypeError):
+                logger.warning(f"Skipping unreadable checkpoint line: {line.strip()[:DEBUG_PAYLOAD_CHARS]}")
+    return done
+
+def run_batch(input_path, output_dir, search_workers=BATCH_SEARCH_WORKERS, llm_workers=BATCH_LLM_WORKERS, map_reduce=False,
+              insights=False, max_reviews=None):
+    """Analyze every location in input_path, writing one markdown report per location to output_dir.
+
+    Competitor data is gathered by one worker pool and fed to a second pool of LLM workers.
+    With map_reduce, the per-competitor summaries also run in the LLM pool, so llm_workers
+    caps every call to the model. Finished locations are recorded in output_dir/checkpoint.jsonl, so a rerun after a crash
+    skips them and only processes what is left.
+    """
+    api_key = os.getenv("SERPAPI_API_KEY")
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint_path = os.path.join(output_dir, "checkpoint.jsonl")
+    done = read_checkpoint(checkpoint_path)
+    locations = [location for location in dict.fromkeys(read_locations(input_path)) if location not in done]
+    logger.info(f"Batch: {len(locations)} locations to process, {len(done)} already done")
+
+    client = create_llm_client()
+
+    def analyze(location, prompt):
+        ai_output = generate_analysis(client, prompt)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", location).strip("_").lower()
+        md_filename = os.path.join(output_dir, f"ai_response_{slug}.md")
+        with open(md_filename, "w", encoding="utf-8") as md_file:
+            md_file.write(ai_output)
+        return md_filename
+
+    stages = {}        # Future -> (stage, location, index of the summarized competitor)
+    map_results = {}   # Location -> (competitors, their summaries so far) in map-reduce mode
+    failed = set()
+    pending = set()
+
+    def submit(pool, stage, location, fn, *args, index=None):
+        future = pool.submit(fn, *args)
+        stages[future] = (stage, location, index)
+        pending.add(future)
+
+    def reduce_when_summarized(location):
+        competitors, summaries = map_results[location]
+        if all(summary is not None for summary in summaries):
+            del map_results[location]
+            submit(llm_pool, "analysis", location, analyze, location, build_summaries_prompt(competitors, summaries))
+
+    with JsonlSink(checkpoint_path) as checkpoint, \
+            ThreadPoolExecutor(max_workers=search_workers) as search_pool, \
+            ThreadPoolExecutor(max_workers=llm_workers) as llm_pool:
+        for location in locations:
+            if map_reduce:
+                submit(search_pool, "gather", location, gather_location, location, api_key, None, insights, max_reviews)
+            else:
+                submit(search_pool, "prompt", location, prepare_prompt, location, api_key, client, False, None, insights, max_reviews)
+        # One loop over every stage, so each analysis is checkpointed as soon as it is saved,
+        # even while other locations are still gathering data
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, location, index = stages.pop(future)
+                if location in failed:
+                    continue
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed.add(location)
+                    map_results.pop(location, None)
+                    action = "gather data for" if stage in ("gather", "prompt") else "analyze"
+                    logger.error(f"Failed to {action} {location}: {e}")
+                    continue
+                if stage == "gather":
+                    map_results[location] = (result, [None] * len(result))
+                    for i, shop in enumerate(result):
+                        submit(llm_pool, "summary", location, summarize_competitor, client, shop, index=i)
+                    reduce_when_summarized(location)
+                elif stage == "summary":
+                    map_results[location][1][index] = result
+                    reduce_when_summarized(location)
+                elif stage == "prompt":
+                    submit(llm_pool, "analysis", location, analyze, location, result)
+                else:
+                    checkpoint.write({"location": location, "output": result, "completed_at": now()})
+                    logger.info(f"Saved analysis for {location} to {result}")
+    logger.info(f"Batch finished: {len(locations) - len(failed)} succeeded, {len(failed)} failed")
+
 def main():
     load_dotenv()
 
+    parser = argparse.ArgumentParser(description=f"Predict the success of a new {BUSINESS_TYPE.lower()} in a location.")
+    parser.add_argument("--batch", metavar="FILE", help="CSV or JSONL file of locations to analyze without prompting")
+    parser.add_argument("--output-dir", default="batch_results", help="Directory for batch reports and the checkpoint file")
+    parser.add_argument("--search-workers", type=int, default=BATCH_SEARCH_WORKERS)
+    parser.add_argument("--llm-workers", type=int, default=BATCH_LLM_WORKERS)
+    parser.add_argument("--stream", action="store_true", help="Print the AI response as it is generated")
+    parser.add_argument("--map-reduce", action="store_true", help="Summarize each competitor separately before the final analysis")
+    parser.add_argument("--insights", action="store_true", help="Send locally computed review statistics instead of raw reviews")
+    parser.add_argument("--reviews-per-shop", type=int,
+                        help=f"Reviews fetched per shop (default {REVIEWS_PER_SHOP}, or {INSIGHT_REVIEWS_PER_SHOP} with --insights)")
+    sweep = parser.add_mutually_exclusive_group()
+    sweep.add_argument("--bbox", metavar="S,W,N,E", help="Sweep a grid over this bounding box instead of one search")
+    sweep.add_argument("--radius", metavar="LAT,LNG,KM", help="Sweep a grid over this circle instead of one search")
+    parser.add_argument("--sweep-workers", type=int, default=SWEEP_WORKERS)
+    parser.add_argument("--sweep-shops", type=int, default=SWEEP_PROMPT_SHOPS, help="Most reviewed swept shops to analyze")
+    parser.add_argument("--fresh", action="store_true", help=f"Ignore {COMPETITOR_DB} and fetch the most relevant reviews from scratch")
+    parser.add_argument("--no-llm-cache", action="store_true", help=f"Always call the LLM instead of reusing answers from {LLM_CACHE_PATH}")
+    parser.add_argument("--metrics", metavar="FILE", help="Append per-stage timings and counters of this run to a JSON lines file")
+    parser.add_argument("--metrics-port", type=int, help="Serve metrics in Prometheus text format on this port while running")
+    args = parser.parse_args()
+    global competitor_store, llm_cache
+    if args.fresh:
+        competitor_store = None
+    if args.no_llm_cache:
+        llm_cache = None
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    try:
+        run_pipeline(args)
+    finally:
+        if args.metrics:
+            metrics.write_jsonl(args.metrics)
+            logger.info(f"Appended run metrics to {args.metrics}")
+
+def run_pipeline(args):
+    if args.batch:
+        run_batch(args.batch, args.output_dir, args.search_workers, args.llm_workers, args.map_reduce, args.insights,
+                  args.reviews_per_shop)
+        return
+
     api_key = os.getenv("SERPAPI_API_KEY")
-    while True:
+    area = None
+    if args.bbox or args.radius:
+        area = {"bbox": args.bbox, "radius": args.radius, "max_workers": args.sweep_workers, "max_shops": args.sweep_shops}
+        user_input = args.radius or args.bbox
+    while area is None:
         user_input = input("Enter your business location name or coordinates (e.g., 'Austin, TX' or '30.2957009,-98.0626221') [type 'q' or 'quit' to exit]: ").strip()
         if user_input.lower() in ["q", "quit"]:
             print("Exiting program.")
@@ -172,31 +1346,19 @@ def main():
 
     global now
     now = lambda: datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    search_params = get_search_params(user_input, api_key)
-    local_results = fetch_shops_details(search_params)
-    competitors = build_competitor_data(local_results)
-    competitor_data_str = format_competitor_data(competitors)
-    prompt = build_prompt(competitor_data_str)
-
-    client = OpenAI(
-        base_url="http://localhost:11434/v1",  # Local Ollama API
-        api_key="ollama"                       # Dummy key
-    )
-    response = client.chat.completions.create(
-        model="gpt-oss:20b",
-        messages=[
-            {"role": "user", "content": prompt}
-        ]
-    )
-    ai_output = response.choices[0].message.content
-    logger.debug(f"AI response: {ai_output[:500]}")
+    client = create_llm_client()
+    prompt = prepare_prompt(user_input, api_key, client, args.map_reduce, area, args.insights, args.reviews_per_shop)
 
     # Save AI output to markdown file with timestamp
     md_filename = f"ai_response_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md"
     with open(md_filename, "w", encoding="utf-8") as md_file:
-        md_file.write(ai_output)
-
-    print(ai_output)
+        if args.stream:
+            generate_analysis(client, prompt, stream=True, outputs=(sys.stdout, md_file))
+            print()
+        else:
+            ai_output = generate_analysis(client, prompt)
+            md_file.write(ai_output)
+            print(ai_output)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,117 @@
+"""Offline checks of the competitor store's review refreshes against the stub SerpApi server
+
+Runs against the stub server in ../benchmarks, so no API key or credits are needed:
+
+    pip install pytest
+    pytest test_main.py
+"""
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+
+import main
+from stub_server import start_stub_server
+
+UNLIMITED = 10 ** 9
+REVIEW_PAGES = 3
+SHOP_REVIEWS = 8 + 16 * (REVIEW_PAGES - 1)  # The stub's first review page holds 8 reviews, later pages 16
+
+@pytest.fixture(scope="module")
+def stub():
+    server, stub, base_url = start_stub_server(review_pages=REVIEW_PAGES)
+    yield stub, base_url
+    server.shutdown()
+
+@pytest.fixture
+def store(stub, tmp_path, monkeypatch):
+    """An empty store; responses are never cached, so every review page fetched reaches the stub"""
+    stub, base_url = stub
+    monkeypatch.setattr(main, "http_client", main.SerpApiClient(base_url))
+    monkeypatch.setattr(main, "rate_limiter", main.TokenBucket(UNLIMITED, UNLIMITED))
+    monkeypatch.setattr(main, "response_cache", main.ResponseCache(path=str(tmp_path / "cache.sqlite3"), default_ttl=0))
+    monkeypatch.setattr(main.logger, "handlers", [main.stream_handler])  # Keep debug.log out of the project folder
+    return main.CompetitorStore(path=str(tmp_path / "competitors.sqlite3"))
+
+def requests_made(stub, call):
+    before = stub.request_count
+    result = call()
+    return stub.request_count - before, result
+
+def test_shop_with_fewer_reviews_than_budget_is_not_refetched(stub, store):
+    stub, _ = stub
+    requests, reviews = requests_made(stub, lambda: main.refresh_reviews(store, "shop-1", "Shop", max_reviews=100))
+    assert requests == REVIEW_PAGES
+    assert len(reviews) == SHOP_REVIEWS
+    for _ in range(2):
+        requests, again = requests_made(stub, lambda: main.refresh_reviews(store, "shop-1", "Shop", max_reviews=100))
+        assert requests == 0
+        assert again == reviews
+
+    store.refresh_after = 0  # Once the refresh interval has passed, the shop is checked again
+    requests, _ = requests_made(stub, lambda: main.refresh_reviews(store, "shop-1", "Shop", max_reviews=100))
+    assert requests == REVIEW_PAGES
+
+def test_raising_the_budget_backfills_older_reviews(stub, store):
+    stub, _ = stub
+    requests, first = requests_made(stub, lambda: main.refresh_reviews(store, "shop-2", "Shop", max_reviews=8))
+    assert (requests, len(first)) == (1, 8)
+    requests, _ = requests_made(stub, lambda: main.refresh_reviews(store, "shop-2", "Shop", max_reviews=8))
+    assert requests == 0
+
+    more = main.refresh_reviews(store, "shop-2", "Shop", max_reviews=30)
+    direct = list(main.iter_reviews("shop-2", "Shop", 30, sort_by="newestFirst"))
+    assert [review["review_id"] for review in more] == [review["review_id"] for review in direct]
+    requests, _ = requests_made(stub, lambda: main.refresh_reviews(store, "shop-2", "Shop", max_reviews=30))
+    assert requests == 0
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """Replaces the model with one that records how many calls run at once"""
+    calls = {"total": 0, "running": 0, "most": 0}
+    lock = threading.Lock()
+
+    def complete_prompt(client, prompt, stream=False, outputs=()):
+        with lock:
+            calls["total"] += 1
+            calls["running"] += 1
+            calls["most"] = max(calls["most"], calls["running"])
+        time.sleep(0.01)
+        with lock:
+            calls["running"] -= 1
+        return "- Analysis"
+
+    monkeypatch.setattr(main, "complete_prompt", complete_prompt)
+    monkeypatch.setattr(main, "llm_cache", None)
+    return calls
+
+def test_map_reduce_batch_stays_within_llm_workers(store, fake_llm, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "competitor_store", store)
+    locations = ["Austin, TX", "Denver, CO", "Portland, OR"]
+    input_path = tmp_path / "locations.csv"
+    input_path.write_text("location\n" + "\n".join(f'"{location}"' for location in locations) + "\n")
+    output_dir = tmp_path / "reports"
+
+    main.run_batch(str(input_path), str(output_dir), search_workers=3, llm_workers=1, map_reduce=True)
+    assert fake_llm["most"] == 1
+    assert fake_llm["total"] > len(locations)  # One summary per competitor, then one analysis per location
+    assert main.read_checkpoint(str(output_dir / "checkpoint.jsonl")) == set(locations)
+
+def test_checkpoint_cut_off_by_a_crash_resumes(store, fake_llm, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "competitor_store", store)
+    input_path = tmp_path / "locations.csv"
+    input_path.write_text("location\nAustin\nDenver\n")
+    output_dir = tmp_path / "reports"
+    main.run_batch(str(input_path), str(output_dir))
+    checkpoint = output_dir / "checkpoint.jsonl"
+    lines = checkpoint.read_text().splitlines()
+    checkpoint.write_text(lines[0] + "\n" + lines[1][:len(lines[1]) // 2])  # The crash cut off the last record
+
+    done = main.read_checkpoint(str(checkpoint))
+    assert len(done) == 1
+    main.run_batch(str(input_path), str(output_dir))
+    assert main.read_checkpoint(str(checkpoint)) == {"Austin", "Denver"}
@@ -1,74 +1,350 @@
-from serpapi import GoogleSearch
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+import asyncio
+import os
+import re
+import argparse
 import json
+import gzip
+import importlib.util
 
-def extract_amazon_data(api_key, search_term):
+CACHE_TTLS = {"amazon": 6 * 3600}
+REQUESTS_PER_SECOND = 5  # Shared by all keyword searches; keep within your SerpApi plan's limit
+REQUESTS_BURST = 5
+CURRENCY_SYMBOLS = [  # Longest symbols first so "C$" is not read as "$"
+    ("R$", "BRL"), ("C$", "CAD"), ("A$", "AUD"), ("MX$", "MXN"),
+    ("$", "USD"), ("€", "EUR"), ("£", "GBP"), ("¥", "JPY"), ("₹", "INR"), ("zł", "PLN"), ("kr", "SEK"),
+]
+PRICE_PATTERN = re.compile(r'\d[\d.,\s\u00a0\u202f]*')
+
+# Rate limiters, SerpApi clients and the response cache shared with the other tools (the folders are not packages)
+_serpapi_spec = importlib.util.spec_from_file_location(
+    "serpapi_common", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "serpapi_common.py"))
+serpapi_common = importlib.util.module_from_spec(_serpapi_spec)
+_serpapi_spec.loader.exec_module(serpapi_common)
+TokenBucket, ResponseCache = serpapi_common.TokenBucket, serpapi_common.ResponseCache
+SerpApiClient, AsyncSerpApiClient = serpapi_common.SerpApiClient, serpapi_common.AsyncSerpApiClient
+
+rate_limiter = TokenBucket(REQUESTS_PER_SECOND, REQUESTS_BURST)
+
+http_client = SerpApiClient()  # Keep-alive pool shared by all keyword searches
+
+response_cache = ResponseCache(ttls=CACHE_TTLS)
+
+@dataclass
+class ProductRecord:
     """
-    Extract titles, prices, and review counts from Amazon search results using SerpApi
+    A product with its fields parsed once at ingestion: numeric price and currency,
+    integer review count, float rating
+    """
+    title: str
+    asin: Optional[str]
+    price: Optional[float]
+    currency: Optional[str]
+    price_text: Optional[str]
+    review_count: Optional[int]
+    rating: Optional[float]
+    brand: Optional[str]
+    keyword: str
+    page: int
+
+    __slots__ = ("title", "asin", "price", "currency", "price_text", "review_count", "rating", "brand",
+                 "keyword", "page")
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+def parse_price_text(price_text):
+    """
+    Parse a price string like "$1,299.99" or "1.299,99 €" into (amount, currency code)
+    
+    A separator followed by one or two trailing digits is treated as the decimal point,
+    so both US and European number formats are understood.
+    """
+    currency = next((code for symbol, code in CURRENCY_SYMBOLS if symbol in price_text), None)
+    match = PRICE_PATTERN.search(price_text)
+    if not match:
+        return None, currency
+    number = re.sub(r'[\s\u00a0\u202f]', '', match.group()).rstrip('.,')
+    decimals = re.search(r'[.,](\d{1,2})$', number)
+    if decimals:
+        number = re.sub(r'[.,]', '', number[:decimals.start()]) + '.' + decimals.group(1)
+    else:
+        number = re.sub(r'[.,]', '', number)
+    return float(number), currency
+
+def parse_count(value):
+    """
+    Parse a review count given as a number or a string like "12,345"
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    digits = re.sub(r'\D', '', str(value))
+    return int(digits) if digits else None
+
+def parse_product(item, keyword, page):
+    """
+    Build a ProductRecord from one organic result, or None if it has no title
+    
+    The brand falls back to the first word of the title when the result has none.
+    """
+    if "title" not in item:
+        return None
+    
+    # Extract price
+    price_text = item.get("price", item.get("price_raw"))
+    price, currency = parse_price_text(str(price_text)) if price_text is not None else (None, None)
+    if "extracted_price" in item:
+        price = float(item["extracted_price"])
+    
+    # Extract review count and rating
+    rating = item.get("rating")
+    review_count = item.get("reviews")
+    if isinstance(rating, dict):
+        review_count = rating.get("reviews", review_count)
+        rating = rating.get("rating")
+    
+    return ProductRecord(
+        title=item["title"],
+        asin=item.get("asin"),
+        price=price,
+        currency=currency,
+        price_text=str(price_text) if price_text is not None else None,
+        review_count=parse_count(review_count) if review_count is not None else None,
+        rating=float(rating) if rating is not None else None,
+        brand=item.get("brand") or next(iter((item["title"] or "").split()), None),  # Empty titles have no brand
+        keyword=keyword,
+        page=page
+    )
+
+def aggregate_products(products):
+    """
+    Summarize a result set: price range and share of shelf per brand
     
     Args:
-        api_key (str): Your SerpApi API key
-        search_term (str): The search term for Amazon products
+        products (list): ProductRecord objects
     
     Returns:
-        list: List of dictionaries containing product information
+        dict: Product count, min/median/max price (per currency) and the share of
+        products belonging to each brand, largest first
     """
+    prices = np.array([p.price if p.price is not None else np.nan for p in products], dtype=float)
+    currencies = np.array([p.currency or "" for p in products])
+    brands = np.array([p.brand or "" for p in products])
     
-    # Set up search parameters
+    price_stats = {}
+    for currency in np.unique(currencies[~np.isnan(prices)]):
+        values = prices[(currencies == currency) & ~np.isnan(prices)]
+        price_stats[str(currency) or "unknown"] = {
+            "min": float(values.min()),
+            "median": float(np.median(values)),
+            "max": float(values.max())
+        }
+    
+    names, counts = np.unique(brands, return_counts=True)
+    order = np.argsort(-counts, kind="stable")
+    share_of_shelf = {str(names[i]): round(float(counts[i]) / len(products), 4) for i in order}
+    
+    return {"total_products": len(products), "price": price_stats, "share_of_shelf": share_of_shelf}
+
+def aggregate_by_keyword(products):
+    """
+    Run aggregate_products separately for each keyword in a multi-keyword result set
+    """
+    groups = {}
+    for product in products:
+        groups.setdefault(product.keyword, []).append(product)
+    return {keyword: aggregate_products(group) for keyword, group in groups.items()}
+
+def print_aggregate(stats):
+    """
+    Print the price ranges and top brands of an aggregate_products summary
+    """
+    for currency, price in stats["price"].items():
+        print(f"- Price range ({currency}): {price['min']:.2f} - {price['max']:.2f}, median {price['median']:.2f}")
+    top_brands = list(stats["share_of_shelf"].items())[:3]
+    print(f"- Top brands by share of shelf: {', '.join(f'{brand} ({share:.0%})' for brand, share in top_brands)}")
+
+def search_amazon(params):
+    """
+    Run a SerpApi search on the shared connection pool, waiting for the shared rate limiter before each attempt
+    """
+    return http_client.search(params, rate_limiter)
+
+def amazon_search_params(api_key, search_term, page=1):
+    """
+    SerpApi parameters for one page of Amazon search results
+    """
     params = {
         "api_key": api_key,
         "engine": "amazon",
         "k": search_term
     }
+    if page > 1:
+        params["page"] = page
+    return params
+
+def extract_amazon_data(api_key, search_term, page=1):
+    """
+    Extract titles, prices, and review counts from Amazon search results using SerpApi
+    
+    Args:
+        api_key (str): Your SerpApi API key
+        search_term (str): The search term for Amazon products
+        page (int): Results page to fetch
     
-    # Perform the search
-    search = GoogleSearch(params)
-    results = search.get_dict()
+    Returns:
+        list: ProductRecord objects for the products found
+    """
+    
+    # Perform the search (served from the local cache when possible)
+    results = response_cache.search(amazon_search_params(api_key, search_term, page), search_amazon)
     
     # Extract product data
     products = []
     
     # Check if organic results exist
-    if "organic_results" in results:
-        for item in results["organic_results"]:
-            product_data = {}
-            
-            # Extract title
-            if "title" in item:
-                product_data["title"] = item["title"]
-            
-            # Extract price
-            if "price" in item:
-                product_data["price"] = item["price"]
-            elif "price_raw" in item:
-                product_data["price"] = item["price_raw"]
-            
-            # Extract review count
-            if "reviews" in item:
-                product_data["review_count"] = item["reviews"]
-            elif "rating" in item and isinstance(item["rating"], dict) and "reviews" in item["rating"]:
-                product_data["review_count"] = item["rating"]["reviews"]
-            
-            # Only add products that have at least a title
-            if "title" in product_data:
-                products.append(product_data)
+    for item in results.get("organic_results", []):
+        product = parse_product(item, search_term, page)
+        # Only add products that have at least a title
+        if product is not None:
+            products.append(product)
     
     return products
 
+def track_keywords(api_key, keywords, pages=1, max_workers=5, errors=None):
+    """
+    Search many keywords concurrently and yield their products
+    
+    All pages of all keywords are fetched on one thread pool under the shared rate
+    limiter. Products are yielded keyword by keyword, page by page, as soon as their
+    page is ready, with duplicate ASINs within a keyword skipped.
+    
+    Args:
+        api_key (str): Your SerpApi API key
+        keywords (list): Search terms to track
+        pages (int): Number of result pages to fetch per keyword
+        max_workers (int): Maximum number of requests in flight
+        errors (list): If given, (keyword, page, exception) is appended for each page that failed
+    
+    Yields:
+        ProductRecord: Products tagged with the keyword and page they were found on
+    """
+    keywords = list(dict.fromkeys(keywords))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            (keyword, page, executor.submit(extract_amazon_data, api_key, keyword, page))
+            for keyword in keywords
+            for page in range(1, pages + 1)
+        ]
+        seen = set()
+        for keyword, page, future in futures:
+            try:
+                products = future.result()
+            except Exception as e:
+                print(f"Error fetching page {page} for '{keyword}': {e}")
+                if errors is not None:
+                    errors.append((keyword, page, e))
+                continue
+            for product in products:
+                if product.asin:
+                    if (keyword, product.asin) in seen:
+                        continue
+                    seen.add((keyword, product.asin))
+                yield product
+
+async def aextract_amazon_data(api_key, search_term, page=1, client=None):
+    """
+    Async variant of extract_amazon_data that yields ProductRecord objects
+    
+    Args:
+        api_key (str): Your SerpApi API key
+        search_term (str): The search term for Amazon products
+        page (int): Results page to fetch
+        client (AsyncSerpApiClient): Client shared between calls; one is opened for this call if omitted
+    
+    Yields:
+        ProductRecord: Products found on the page
+    """
+    if client is None:
+        async with AsyncSerpApiClient(rate=REQUESTS_PER_SECOND, burst=REQUESTS_BURST) as client:
+            async for product in aextract_amazon_data(api_key, search_term, page, client):
+                yield product
+        return
+    
+    results = await response_cache.asearch(amazon_search_params(api_key, search_term, page), client.search)
+    for item in results.get("organic_results", []):
+        product = parse_product(item, search_term, page)
+        if product is not None:
+            yield product
+
+async def atrack_keywords(api_key, keywords, pages=1, client=None):
+    """
+    Async variant of track_keywords
+    
+    Every page of every keyword is scheduled on the event loop at once; the client's
+    max_concurrency and rate limiter decide how many requests are actually in flight.
+    Products are yielded in the same order as track_keywords, with duplicate ASINs
+    within a keyword skipped.
+    
+    Args:
+        api_key (str): Your SerpApi API key
+        keywords (list): Search terms to track
+        pages (int): Number of result pages to fetch per keyword
+        client (AsyncSerpApiClient): Client to use; one is opened for this call if omitted
+    
+    Yields:
+        ProductRecord: Products tagged with the keyword and page they were found on
+    """
+    if client is None:
+        async with AsyncSerpApiClient(rate=REQUESTS_PER_SECOND, burst=REQUESTS_BURST) as client:
+            async for product in atrack_keywords(api_key, keywords, pages, client):
+                yield product
+        return
+    
+    async def fetch(keyword, page):
+        return [product async for product in aextract_amazon_data(api_key, keyword, page, client)]
+    
+    tasks = [
+        (keyword, page, asyncio.ensure_future(fetch(keyword, page)))
+        for keyword in dict.fromkeys(keywords)
+        for page in range(1, pages + 1)
+    ]
+    seen = set()
+    try:
+        for keyword, page, task in tasks:
+            try:
+                products = await task
+            except Exception as e:
+                print(f"Error fetching page {page} for '{keyword}': {e}")
+                continue
+            for product in products:
+                if product.asin:
+                    if (keyword, product.asin) in seen:
+                        continue
+                    seen.add((keyword, product.asin))
+                yield product
+    finally:
+        for _, _, task in tasks:
+            task.cancel()
+
 def print_products(products):
     """
     Print the extracted product information in a formatted way
     
     Args:
-        products (list): List of product dictionaries
+        products (list): ProductRecord objects
     """
     print(f"\nFound {len(products)} products:\n")
     print("-" * 80)
     
     for i, product in enumerate(products, 1):
         print(f"Product {i}:")
-        print(f"  Title: {product.get('title', 'N/A')}")
-        print(f"  Price: {product.get('price', 'N/A')}")
-        print(f"  Review Count: {product.get('review_count', 'N/A')}")
+        print(f"  Title: {product.title}")
+        print(f"  Price: {product.price_text if product.price_text is not None else 'N/A'}")
+        print(f"  Review Count: {product.review_count if product.review_count is not None else 'N/A'}")
         print("-" * 80)
 
 def save_to_json(products, filename="amazon_products.json"):
@@ -76,21 +352,83 @@ def save_to_json(products, filename="amazon_products.json"):
     Save the extracted product data to a JSON file
     
     Args:
-        products (list): List of product dictionaries
+        products (list): ProductRecord objects
         filename (str): Name of the output JSON file
     """
     with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(products, f, indent=2, ensure_ascii=False)
+        json.dump([product.to_dict() for product in products], f, indent=2, ensure_ascii=False)
+    print(f"\nData saved to {filename}")
+
+def save_to_jsonl(products, filename="amazon_products.jsonl"):
+    """
+    Stream product data to a JSON Lines file, one product per line, as it is produced
+    
+    The file is gzip-compressed when the filename ends in .gz. A summary record is
+    appended once all products have been written.
+    
+    Args:
+        products (iterable): ProductRecord objects (a list or a generator)
+        filename (str): Name of the output JSONL file
+    
+    Returns:
+        dict: The summary record written at the end of the file
+    """
+    compressed = filename.endswith(".gz")
+    opener = gzip.open if compressed else open
+    summary = {"record": "summary", "total_products": 0, "products_with_prices": 0, "products_with_review_counts": 0}
+    with opener(filename, 'wt', encoding='utf-8') as f:
+        for product in products:
+            f.write(json.dumps({"record": "product", **product.to_dict()}, ensure_ascii=False) + "\n")
+            if not compressed:
+                f.flush()  # Let consumers tail the file during a run
+            summary["total_products"] += 1
+            summary["products_with_prices"] += product.price is not None
+            summary["products_with_review_counts"] += product.review_count is not None
+        f.write(json.dumps(summary) + "\n")
     print(f"\nData saved to {filename}")
+    return summary
+
+def read_keywords(filename):
+    """
+    Read one keyword per line from a text file, skipping blank lines
+    """
+    with open(filename, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
 
 def main():
     """
     Main function to run the Amazon data extraction
     """
     # Your API key and search term
-    api_key = "your-api-key"
+    api_key = os.getenv("SERPAPI_API_KEY", "your-api-key")
     search_term = "Bluetooth Speakers"
     
+    parser = argparse.ArgumentParser(description="Track competitor products on Amazon")
+    parser.add_argument("--keywords", nargs="+", help="Keywords to track")
+    parser.add_argument("--keywords-file", help="Text file with one keyword per line")
+    parser.add_argument("--pages", type=int, default=1, help="Result pages to fetch per keyword")
+    parser.add_argument("--workers", type=int, default=5, help="Maximum number of requests in flight")
+    parser.add_argument("--output", default="amazon_products.jsonl", help="JSONL output file (.gz to compress)")
+    args = parser.parse_args()
+    
+    keywords = (args.keywords or []) + (read_keywords(args.keywords_file) if args.keywords_file else [])
+    if keywords:
+        print(f"Tracking {len(keywords)} keywords, {args.pages} page(s) each")
+        products = []
+        
+        def keep(records):
+            # Products are still streamed to the file; this only keeps them for the summary
+            for product in records:
+                products.append(product)
+                yield product
+        
+        summary = save_to_jsonl(keep(track_keywords(api_key, keywords, args.pages, args.workers)), args.output)
+        print(f"- Total products found: {summary['total_products']}")
+        for keyword, stats in aggregate_by_keyword(products).items():
+            print(f"\n{keyword} ({stats['total_products']} products):")
+            print_aggregate(stats)
+        return
+    
     print(f"Searching for: {search_term}")
     print("Extracting product data...")
     
@@ -107,8 +445,10 @@ def main():
         # Print summary
         print(f"\nSummary:")
         print(f"- Total products found: {len(products)}")
-        print(f"- Products with prices: {sum(1 for p in products if 'price' in p)}")
-        print(f"- Products with review counts: {sum(1 for p in products if 'review_count' in p)}")
+        print(f"- Products with prices: {sum(1 for p in products if p.price is not None)}")
+        print(f"- Products with review counts: {sum(1 for p in products if p.review_count is not None)}")
+        
+        print_aggregate(aggregate_products(products))
         
     except Exception as e:
         print(f"Error occurred: {str(e)}")
@@ -0,0 +1,305 @@
+"""SerpApi plumbing shared by the python_projects tools
+
+Rate limiters, the on-disk response cache and the pooled sync and asyncio HTTP
+clients. The project folders are not packages, so each script loads this file by
+path with importlib, as worker.py and run_benchmarks.py load the scripts.
+
+Requires `requests`; the asyncio client and HTTP/2 also need `pip install httpx`.
+Counters go to the metrics object a tool passes in (anything with
+count(name, value=1, engine=None)) and retries are logged to the logger it passes
+in, or to the "serpapi" logger.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+SERPAPI_BACKEND = os.getenv("SERPAPI_BACKEND", "https://serpapi.com")  # Point at a local stub server for offline runs
+CACHE_PATH = os.getenv("SERPAPI_CACHE_PATH", "serpapi_cache.sqlite3")
+REQUESTS_PER_SECOND = 5  # Keep within your SerpApi plan's throughput limit
+REQUESTS_BURST = 5
+HTTP_TIMEOUT = 30  # Seconds
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5  # Base delay for jittered exponential backoff, in seconds
+HTTP_POOL_SIZE = 5  # Keep-alive connections; match the number of threads sending requests
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+USE_HTTP2 = os.getenv("SERPAPI_HTTP2", "").lower() in ("1", "true", "yes")  # Requires `pip install httpx[http2]`
+
+logger = logging.getLogger("serpapi")
+
+class NoMetrics:
+    """Stand-in for a tool's metrics registry when it keeps none"""
+    def count(self, name, value=1, engine=None):
+        pass
+
+NO_METRICS = NoMetrics()
+
+class TokenBucket:
+    """Thread-safe token-bucket rate limiter: `rate` tokens per second, up to `burst` at once."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                current = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (current - self.updated) * self.rate)
+                self.updated = current
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class AsyncTokenBucket:
+    """asyncio token-bucket rate limiter: waits without blocking the event loop."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                current = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (current - self.updated) * self.rate)
+                self.updated = current
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class SerpApiClient:
+    """Keep-alive HTTP client for SerpApi calls, with timeouts and retries on 429/5xx.
+
+    One client is meant to be shared by every call of a tool, so connections stay open
+    between requests. search() waits for the rate limiter it is given before each attempt;
+    tools pass their module-level limiter, which a service may swap for a slower one.
+    """
+    def __init__(self, base_url=SERPAPI_BACKEND, timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES,
+                 backoff=HTTP_BACKOFF, pool_size=HTTP_POOL_SIZE, http2=USE_HTTP2, metrics=None, logger=logger):
+        self.url = f"{base_url}/search"
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.metrics = metrics or NO_METRICS
+        self.logger = logger
+        if http2:
+            import httpx
+            limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+            self.session = httpx.Client(http2=True, timeout=timeout, limits=limits)
+            self.transport_errors = (httpx.TransportError,)
+        else:
+            self.session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+            self.transport_errors = (requests.ConnectionError, requests.Timeout)
+
+    def search(self, params, rate_limiter=None):
+        engine = params.get("engine")
+        for attempt in range(self.retries + 1):
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            self.metrics.count("serpapi_requests", engine=engine)
+            try:
+                response = self.session.get(self.url, params=params, timeout=self.timeout)
+                self.metrics.count("serpapi_response_bytes", len(response.content), engine=engine)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response.json()
+                error = f"HTTP {response.status_code}"
+            except self.transport_errors as e:
+                error = e
+            if attempt == self.retries:
+                break
+            self.metrics.count("serpapi_retries", engine=engine)
+            delay = random.uniform(0, self.backoff * 2 ** attempt)
+            self.logger.warning(f"SerpApi request failed ({error}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+        self.metrics.count("serpapi_failures", engine=engine)
+        raise RuntimeError(f"SerpApi request failed after {self.retries + 1} attempts: {error}")
+
+class AsyncSerpApiClient:
+    """asyncio counterpart of SerpApiClient for embedding a tool in an async service.
+
+    Requires `pip install httpx`. Requests share one keep-alive pool, wait for an async token
+    bucket and are capped at max_concurrency in flight, so thousands of requests can be
+    scheduled on one event loop without a thread each.
+    """
+    def __init__(self, base_url=SERPAPI_BACKEND, max_concurrency=20, rate=REQUESTS_PER_SECOND, burst=REQUESTS_BURST,
+                 timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF, http2=USE_HTTP2,
+                 metrics=None, logger=logger):
+        import httpx
+        self.url = f"{base_url}/search"
+        self.client = httpx.AsyncClient(http2=http2, timeout=timeout, limits=httpx.Limits(max_connections=max_concurrency))
+        self.transport_errors = (httpx.TransportError,)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limiter = AsyncTokenBucket(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.metrics = metrics or NO_METRICS
+        self.logger = logger
+
+    async def search(self, params):
+        engine = params.get("engine")
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                await self.rate_limiter.acquire()
+                self.metrics.count("serpapi_requests", engine=engine)
+                try:
+                    response = await self.client.get(self.url, params=params)
+                    self.metrics.count("serpapi_response_bytes", len(response.content), engine=engine)
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        return response.json()
+                    error = f"HTTP {response.status_code}"
+                except self.transport_errors as e:
+                    error = e
+                if attempt == self.retries:
+                    break
+                self.metrics.count("serpapi_retries", engine=engine)
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                self.logger.warning(f"SerpApi request failed ({error}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        self.metrics.count("serpapi_failures", engine=engine)
+        raise RuntimeError(f"SerpApi request failed after {self.retries + 1} attempts: {error}")
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+class ResponseCache:
+    """On-disk SQLite cache of SerpApi responses keyed on the request params (minus api_key).
+
+    Entries expire after a per-engine TTL. Once the stored responses exceed max_bytes,
+    the least recently used entries are evicted (eviction="lru"), or the oldest ones
+    (eviction="fifo").
+    """
+
+    def __init__(self, path=CACHE_PATH, ttls=None, default_ttl=24 * 3600, max_bytes=200 * 1024 * 1024, eviction="lru",
+                 metrics=None):
+        if eviction not in ("lru", "fifo"):
+            raise ValueError(f"Unknown eviction policy: {eviction}")
+        self.path = path
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.eviction_order = "accessed_at" if eviction == "lru" else "created_at"
+        self.metrics = metrics or NO_METRICS
+        self.lock = threading.Lock()
+        self.created = False  # The table is created on first use, so a module-level cache creates no file at import
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                if not self.created:
+                    self._create_tables(conn)
+                    self.created = True
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _create_tables(conn):
+        # cache_size holds the total of responses.size, kept up to date by the triggers, so a write
+        # can check the cap without summing the whole table. It is filled from existing rows once.
+        conn.executescript("""
+            BEGIN IMMEDIATE;
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, engine TEXT, body TEXT, size INTEGER, created_at REAL, accessed_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+            CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at);
+            CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL);
+            INSERT OR IGNORE INTO cache_size SELECT 0, COALESCE(SUM(size), 0) FROM responses;
+            CREATE TRIGGER IF NOT EXISTS responses_added AFTER INSERT ON responses
+                BEGIN UPDATE cache_size SET bytes = bytes + new.size; END;
+            CREATE TRIGGER IF NOT EXISTS responses_removed AFTER DELETE ON responses
+                BEGIN UPDATE cache_size SET bytes = bytes - old.size; END;
+            COMMIT;
+        """)
+
+    @staticmethod
+    def make_key(params):
+        normalized = {k: str(v) for k, v in params.items() if k != "api_key" and v is not None}
+        return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key, engine=None):
+        ttl = self.ttls.get(engine, self.default_ttl)
+        with self.lock, self._connect() as conn:
+            row = conn.execute("SELECT body, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[1] > ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def set(self, key, response, engine=None):
+        body = json.dumps(response)
+        timestamp = time.time()
+        with self.lock, self._connect() as conn:
+            # DELETE then INSERT rather than INSERT OR REPLACE, whose implicit delete skips the size trigger
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            conn.execute("INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?)", (key, engine, body, len(body), timestamp, timestamp))
+            excess = conn.execute("SELECT bytes FROM cache_size").fetchone()[0] - self.max_bytes
+            if excess <= 0:
+                return
+            evicted = []
+            rows = conn.execute(f"SELECT key, size FROM responses ORDER BY {self.eviction_order}")
+            for old_key, size in rows:  # Read lazily: only the entries that have to go
+                if excess <= 0:
+                    break
+                evicted.append((old_key,))
+                excess -= size
+            rows.close()
+            conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def search(self, params, fetch):
+        """Return the cached response for params, or call fetch(params) and cache its result."""
+        key = self.make_key(params)
+        engine = params.get("engine")
+        cached = self.get(key, engine)
+        if cached is not None:
+            self.metrics.count("cache_hits", engine=engine)
+            return cached
+        self.metrics.count("cache_misses", engine=engine)
+        response = fetch(params)
+        if "error" not in response:
+            self.set(key, response, engine)
+        return response
+
+    async def asearch(self, params, fetch):
+        """Async search(): fetch is a coroutine function, and the SQLite work runs in the default executor."""
+        key = self.make_key(params)
+        engine = params.get("engine")
+        cached = await asyncio.to_thread(self.get, key, engine)
+        if cached is not None:
+            self.metrics.count("cache_hits", engine=engine)
+            return cached
+        self.metrics.count("cache_misses", engine=engine)
+        response = await fetch(params)
+        if "error" not in response:
+            await asyncio.to_thread(self.set, key, response, engine)
+        return response
@@ -0,0 +1,60 @@
+"""Micro-benchmark for the product parsing stage of trending_products.py
+
+Runs extract_products_from_results over synthetic API results (no API calls)
+and prints the per-item cost.
+
+    python benchmark_parsing.py [items]
+"""
+import sys
+import timeit
+
+from trending_products import ImprovedSmartHomeTrendingAnalyzer, ResponseCache, parse_price, parse_quantity
+
+QUANTITIES = ["50+ bought in past month", "100+ bought in past month", "1K+ bought in past month",
+              "5K+ bought in past month", "10K+ bought in past month", ""]
+
+def make_results(items: int, with_extracted_price: bool = True):
+    organic_results = []
+    for i in range(items):
+        item = {
+            "position": i + 1,
+            "asin": f"B{i:09d}",
+            "title": f"Smart Plug {i}",
+            "price": f"${1000 + i % 500:,}.99",
+            "rating": 4.0 + (i % 10) / 10,
+            "reviews": i * 7,
+            "bought_last_month": QUANTITIES[i % len(QUANTITIES)],
+            "link": f"https://www.amazon.com/dp/B{i:09d}",
+            "thumbnail": f"https://m.media-amazon.com/images/I/{i}.jpg",
+        }
+        if with_extracted_price:
+            item["extracted_price"] = 1000 + i % 500 + 0.99
+        organic_results.append(item)
+    return {"organic_results": organic_results}
+
+def report(label: str, seconds: float, items: int):
+    print(f"{label:<45} {seconds / items * 1e6:8.2f} us/item")
+
+def main():
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = 5
+    analyzer = ImprovedSmartHomeTrendingAnalyzer("", cache=ResponseCache(path=":memory:"))
+
+    print(f"Parsing {items:,} products, best of {repeat} runs\n")
+    for label, results in [("extract_products_from_results", make_results(items)),
+                           ("  ...without extracted_price", make_results(items, with_extracted_price=False))]:
+        best = min(timeit.repeat(lambda: analyzer.extract_products_from_results(results, 1), number=1, repeat=repeat))
+        report(label, best, items)
+
+    quantity_strings = [QUANTITIES[i % len(QUANTITIES)] for i in range(items)]
+    best = min(timeit.repeat(lambda: [parse_quantity(q) for q in quantity_strings], number=1, repeat=repeat))
+    report("parse_quantity (memoized)", best, items)
+    best = min(timeit.repeat(lambda: [parse_quantity.__wrapped__(q) for q in quantity_strings], number=1, repeat=repeat))
+    report("parse_quantity (uncached)", best, items)
+
+    price_strings = [f"${1000 + i % 500:,}.99" for i in range(items)]
+    best = min(timeit.repeat(lambda: [parse_price.__wrapped__(p) for p in price_strings], number=1, repeat=repeat))
+    report("parse_price (uncached)", best, items)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Offline checks that the optimized fetch and ranking paths keep the original output
+
+Runs against the stub SerpApi server in ../benchmarks, so no API key or credits are needed:
+
+    pip install pytest
+    pytest test_trending_products.py
+"""
+import json
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+
+from stub_server import start_stub_server
+import trending_products
+from trending_products import (ImprovedSmartHomeTrendingAnalyzer, JsonlWriter, ProductData, ResponseCache, SerpApiClient,
+                               TokenBucket, parse_price, parse_quantity)
+
+UNLIMITED = 10 ** 9
+
+@pytest.fixture(scope="module")
+def stub():
+    server, stub, base_url = start_stub_server(latency=0.005, amazon_pages=7)
+    yield base_url
+    server.shutdown()
+
+@pytest.fixture
+def make_analyzer(stub, tmp_path, monkeypatch):
+    """A new analyzer with an empty cache of its own, so every fetch reaches the stub"""
+    monkeypatch.setattr(trending_products, "http_client", SerpApiClient(stub))
+    caches = iter(range(1000))
+
+    def make_analyzer(**options):
+        cache = ResponseCache(path=str(tmp_path / f"cache_{next(caches)}.sqlite3"))
+        return ImprovedSmartHomeTrendingAnalyzer("test", cache=cache, rate_limiter=TokenBucket(UNLIMITED, UNLIMITED),
+                                                 **options)
+    return make_analyzer
+
+def report(analyzer, products):
+    data = analyzer.generate_comprehensive_json(products)
+    del data["analysis_metadata"]["analysis_date"]
+    return data
+
+@pytest.mark.parametrize("pages, early_stop", [(5, True), (10, True), (10, False)])
+def test_concurrent_fetch_matches_serial(make_analyzer, pages, early_stop):
+    serial = make_analyzer()
+    expected = serial.fetch_smart_home_best_sellers(pages=pages, early_stop=early_stop)
+    assert expected
+
+    for max_workers in (2, 8):
+        concurrent = make_analyzer()
+        products = concurrent.fetch_smart_home_best_sellers(pages=pages, max_workers=max_workers, early_stop=early_stop)
+        assert [p.to_dict() for p in products] == [p.to_dict() for p in expected]
+        assert concurrent.pages_analyzed == serial.pages_analyzed
+        assert report(concurrent, products) == report(serial, expected)
+
+def test_concurrent_stream_matches_serial(make_analyzer, tmp_path):
+    outputs = []
+    for max_workers in (1, 8):
+        filename = str(tmp_path / f"products_{max_workers}.jsonl")
+        with JsonlWriter(filename) as writer:
+            make_analyzer().fetch_smart_home_best_sellers(pages=10, max_workers=max_workers, writer=writer)
+        with open(filename, encoding="utf-8") as f:
+            outputs.append([json.loads(line) for line in f])
+    assert outputs[0] and outputs[0] == outputs[1]
+
+# The original sort-based rankings and statistics, kept as the reference for the NumPy column store
+def reference_rankings(products):
+    def trending_score(product):
+        rating_score = (product.rating or 0) * 20
+        review_score = min((product.reviews or 0) / 1000, 100)
+        revenue_score = min((product.revenue_estimate or 0) / 10000, 100)
+        return (rating_score * 0.4) + (review_score * 0.3) + (revenue_score * 0.3)
+
+    return {
+        "top_by_reviews": sorted(products, key=lambda x: x.reviews or 0, reverse=True),
+        "top_by_rating": sorted(products, key=lambda x: x.rating or 0, reverse=True),
+        "top_by_revenue": sorted(products, key=lambda x: x.revenue_estimate or 0, reverse=True),
+        "top_trending": sorted(products, key=trending_score, reverse=True),
+    }
+
+def reference_statistics(products):
+    with_price = len([p for p in products if p.price])
+    with_rating = len([p for p in products if p.rating])
+    average_price = sum(p.price for p in products if p.price) / with_price if with_price else 0
+    average_rating = sum(p.rating for p in products if p.rating) / with_rating if with_rating else 0
+    return {
+        "products_with_price": with_price,
+        "products_with_rating": with_rating,
+        "products_with_reviews": len([p for p in products if p.reviews]),
+        "products_with_quantity_data": len([p for p in products if p.bought_last_month]),
+        "average_price": round(average_price, 2),
+        "average_rating": round(average_rating, 2),
+        "total_estimated_revenue": round(sum(p.revenue_estimate for p in products if p.revenue_estimate), 2),
+    }
+
+def random_products(rng, count):
+    """Products with many ties and missing values, the cases where rankings can drift"""
+    quantities = ["", "50+ bought in past month", "1K+ bought in past month", "10K+ bought in past month"]
+    products = []
+    for i in range(count):
+        price = rng.choice([None, round(rng.uniform(5, 500), 2), rng.choice([9.99, 19.99, 24.99])])
+        bought = rng.choice(quantities)
+        products.append(ProductData(
+            position=i + 1, asin=f"B{i:09d}", title=f"Product {i}", price=price,
+            rating=rng.choice([None, 3.9, 4.5, 4.7, round(rng.uniform(1, 5), 1)]),
+            reviews=rng.choice([None, 0, 120, 5000, rng.randint(0, 200000)]),
+            bought_last_month=bought,
+            revenue_estimate=price * parse_quantity(bought) if price and bought else 0.0,
+            link="", thumbnail="", page_found=1 + i // 20
+        ))
+    return products
+
+def test_rankings_and_statistics_match_original():
+    rng = random.Random(9)
+    analyzer = ImprovedSmartHomeTrendingAnalyzer("test", cache=ResponseCache(path=":memory:"))
+    for _ in range(500):
+        products = random_products(rng, rng.randint(0, 80))
+        expected = reference_rankings(products)
+        data = analyzer.generate_comprehensive_json(products)
+
+        assert data["statistics"] == reference_statistics(products)
+        for name, ranking in expected.items():
+            assert [entry["asin"] for entry in data["rankings"][name]] == [p.asin for p in ranking[:10]]
+            assert [products[entry["index"]] for entry in data["rankings"][name]] == ranking[:10]
+        assert analyzer.rank_by_reviews(products) == expected["top_by_reviews"]
+        assert analyzer.rank_by_rating(products, limit=5) == expected["top_by_rating"][:5]
+        assert analyzer.rank_by_revenue(products) == expected["top_by_revenue"]
+        assert analyzer.rank_by_trending_score(products, limit=3) == expected["top_trending"][:3]
+
+@pytest.mark.parametrize("text, price", [
+    ("$1,299.99", 1299.99), ("1.299,99 €", 1299.99), ("€12.99", 12.99), ("€1,299.99", 1299.99),
+    ("12,5 €", 12.5), ("1.299 €", 1299.0), ("1\u202f299,99\u00a0€", 1299.99), ("£7", 7.0), ("N/A", None),
+])
+def test_parse_price_formats(text, price):
+    assert parse_price(text) == price
+
+@pytest.mark.parametrize("eviction, kept", [("lru", "k0"), ("fifo", "k9")])
+def test_cache_stays_under_its_cap(tmp_path, eviction, kept):
+    cache = ResponseCache(path=str(tmp_path / "cache.sqlite3"), max_bytes=500, eviction=eviction)
+    for i in range(10):
+        cache.set(f"k{i}", {"body": "x" * 80})
+        cache.get("k0")  # Recently used, so only LRU keeps it
+        cache.set(f"k{i}", {"body": "x" * 80})  # Replacing an entry must not count its size twice
+    with cache._connect() as conn:
+        size, tracked = conn.execute("SELECT SUM(size), (SELECT bytes FROM cache_size) FROM responses").fetchone()
+    assert size == tracked <= 500
+    assert cache.get(kept) is not None
+    assert cache.get("k1") is None
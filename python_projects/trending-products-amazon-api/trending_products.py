@@ -1,9 +1,112 @@
-from serpapi import GoogleSearch
+import asyncio
+import os
 import json
+import gzip
 import re
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass, asdict
-from datetime import datetime
+import importlib.util
+import sqlite3
+import sys
+import threading
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
+from dataclasses import dataclass
+from datetime import datetime, date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from itertools import islice
+from functools import lru_cache
+import numpy as np
+
+# Rate limiters, SerpApi clients and the response cache shared with the other tools (the folders are not packages)
+_serpapi_spec = importlib.util.spec_from_file_location(
+    "serpapi_common", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "serpapi_common.py"))
+serpapi_common = importlib.util.module_from_spec(_serpapi_spec)
+_serpapi_spec.loader.exec_module(serpapi_common)
+TokenBucket, ResponseCache = serpapi_common.TokenBucket, serpapi_common.ResponseCache
+SerpApiClient, AsyncSerpApiClient = serpapi_common.SerpApiClient, serpapi_common.AsyncSerpApiClient
+
+CACHE_TTLS = {"amazon": 6 * 3600}  # Best-seller ranks move during the day
+REQUESTS_PER_SECOND = 5  # Keep within your SerpApi plan's throughput limit
+REQUESTS_BURST = 5
+SMART_HOME_NODE = "6563140011"  # Smart Home category node ID
+SNAPSHOT_DB = "trending_history.sqlite3"  # Product history across runs
+MAX_DUPLICATE_RATIO = 0.8  # Stop paginating once a page is mostly products already seen
+
+OUTPUT_FORMAT = "json"  # "json" (one document), "jsonl" or "jsonl.gz" (products streamed as they are fetched)
+
+http_client = SerpApiClient()  # One keep-alive pool for every analyzer in the process
+
+QUANTITY_PATTERN = re.compile(r'(\d+(?:\.\d+)?)([KMB]?)\+?')
+PRICE_PATTERN = re.compile(r'\d[\d.,\s\u00a0\u202f]*')
+PRICE_SPACES = re.compile(r'[\s\u00a0\u202f]')
+PRICE_DECIMALS = re.compile(r'[.,](\d{1,2})$')
+PRICE_SEPARATORS = re.compile(r'[.,]')
+QUANTITY_MULTIPLIERS = {'K': 1000, 'M': 1000000, 'B': 1000000000}
+
+@lru_cache(maxsize=1024)
+def parse_quantity(quantity_str: str) -> int:
+    """Parse quantity string like '10K+ bought in past month' to integer
+    
+    Memoized: there are only a handful of distinct "bought last month" strings.
+    """
+    if not quantity_str:
+        return 0
+    
+    # Extract number and multiplier
+    match = QUANTITY_PATTERN.search(quantity_str.upper())
+    if not match:
+        return 0
+    
+    number = float(match.group(1))
+    return int(number * QUANTITY_MULTIPLIERS.get(match.group(2), 1))
+
+@lru_cache(maxsize=4096)
+def parse_price(price_str: str) -> Optional[float]:
+    """Parse a price string like "$1,299.99" or "1.299,99 €" to a number
+    
+    A separator followed by one or two trailing digits is the decimal point, so US and
+    European formats are read correctly on any marketplace (the same rule as
+    parse_price_text in the competitor tracker).
+    """
+    match = PRICE_PATTERN.search(price_str)
+    if not match:
+        return None
+    
+    number = PRICE_SPACES.sub('', match.group()).rstrip('.,')
+    decimals = PRICE_DECIMALS.search(number)
+    if decimals:
+        number = PRICE_SEPARATORS.sub('', number[:decimals.start()]) + '.' + decimals.group(1)
+    else:
+        number = PRICE_SEPARATORS.sub('', number)
+    return float(number)
+
+class JsonlWriter:
+    """Append-only JSON Lines writer, gzip-compressed when the filename ends in .gz
+    
+    Plain files are flushed after every record so they can be tailed during a run.
+    """
+    
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.compressed = filename.endswith(".gz")
+        opener = gzip.open if self.compressed else open
+        self.file = opener(filename, "wt", encoding="utf-8")
+        self.lock = threading.Lock()
+    
+    def write(self, record: Dict[str, Any]):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.file.write(line)
+            if not self.compressed:
+                self.file.flush()
+    
+    def close(self):
+        self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
 
 @dataclass
 class ProductData:
@@ -19,42 +122,105 @@ class ProductData:
     link: str
     thumbnail: str
     page_found: int  # Track which page the product was found on
+    
+    # Slots instead of a per-instance __dict__ keep large crawls small in memory
+    __slots__ = ("position", "asin", "title", "price", "rating", "reviews", "bought_last_month",
+                 "revenue_estimate", "link", "thumbnail", "page_found")
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Shallow dictionary of the product fields (cheaper than dataclasses.asdict)"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class ProductColumns:
+    """Column-oriented (NumPy) view of a product list for fast ranking and statistics"""
+    
+    def __init__(self, products: List[ProductData]):
+        count = len(products)
+        self.products = products
+        self.price = np.fromiter((p.price or 0 for p in products), dtype=float, count=count)
+        self.rating = np.fromiter((p.rating or 0 for p in products), dtype=float, count=count)
+        self.reviews = np.fromiter((p.reviews or 0 for p in products), dtype=float, count=count)
+        self.revenue = np.fromiter((p.revenue_estimate or 0 for p in products), dtype=float, count=count)
+        self.has_quantity = np.fromiter((bool(p.bought_last_month) for p in products), dtype=bool, count=count)
+    
+    def trending_scores(self) -> np.ndarray:
+        """Composite trending score: rating 40%, reviews 30%, revenue 30%"""
+        rating_score = self.rating * 20  # 0-100 scale
+        review_score = np.minimum(self.reviews / 1000, 100)  # Cap at 100
+        revenue_score = np.minimum(self.revenue / 10000, 100)  # Cap at 100
+        return (rating_score * 0.4) + (review_score * 0.3) + (revenue_score * 0.3)
+    
+    def top_indices(self, scores: np.ndarray, limit: Optional[int] = None) -> np.ndarray:
+        """Return product indices by descending score, ties kept in input order (same as a stable sort).
+        
+        When only the top `limit` products are needed, argpartition narrows the candidates
+        before sorting, so ranking stays cheap for very large product sets.
+        """
+        count = len(scores)
+        if limit is None or limit >= count:
+            candidates = np.arange(count)
+        elif limit <= 0:
+            return np.arange(0)
+        else:
+            threshold = scores[np.argpartition(scores, count - limit)[count - limit]]
+            candidates = np.flatnonzero(scores >= threshold)  # Keeps every product tied at the cut-off
+        return candidates[np.lexsort((candidates, -scores[candidates]))][:limit]
+    
+    def top(self, scores: np.ndarray, limit: Optional[int] = None) -> List[ProductData]:
+        """Return products by descending score (see top_indices)"""
+        return [self.products[i] for i in self.top_indices(scores, limit)]
+    
+    def references(self, indices: np.ndarray) -> List[Dict[str, Any]]:
+        """Ranking entries that point into all_products instead of repeating the product"""
+        return [{"index": int(i), "asin": self.products[i].asin} for i in indices]
+    
+    def statistics(self) -> Dict[str, Any]:
+        """Data completeness counts and averages, computed with vectorized reductions
+
+        Sums are added left to right in product order, like the original sum() over the
+        product list. NumPy's pairwise summation can differ in the last bit, which is
+        enough to change a rounded average.
+        """
+        has_price = self.price != 0
+        has_rating = self.rating != 0
+        products_with_price = int(np.count_nonzero(has_price))
+        products_with_rating = int(np.count_nonzero(has_rating))
+        return {
+            "products_with_price": products_with_price,
+            "products_with_rating": products_with_rating,
+            "products_with_reviews": int(np.count_nonzero(self.reviews)),
+            "products_with_quantity_data": int(np.count_nonzero(self.has_quantity)),
+            "average_price": sum(self.price[has_price].tolist()) / products_with_price if products_with_price else 0,
+            "average_rating": sum(self.rating[has_rating].tolist()) / products_with_rating if products_with_rating else 0,
+            "total_estimated_revenue": sum(self.revenue[self.revenue != 0].tolist())
+        }
 
 class ImprovedSmartHomeTrendingAnalyzer:
     """Improved analyzer for Amazon Smart Home trending products with duplicate handling"""
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, cache: Optional[ResponseCache] = None, node: str = SMART_HOME_NODE,
+                 amazon_domain: str = "amazon.com", category: str = "Smart Home Best Sellers",
+                 rate_limiter: Optional[TokenBucket] = None, language: Optional[str] = None):
         self.api_key = api_key
-        self.smart_home_node = "6563140011"  # Smart Home category node ID
+        self.cache = cache or ResponseCache(ttls=CACHE_TTLS)
+        self.node = node  # Amazon browse node ID of the category
+        self.amazon_domain = amazon_domain
+        self.language = language  # e.g. "en_US"; unset uses the marketplace's own language and number format
+        self.category = category
+        self.rate_limiter = rate_limiter or TokenBucket(REQUESTS_PER_SECOND, REQUESTS_BURST)
+        self.pages_analyzed = 0
+        self.page_errors: List[Tuple[int, str]] = []  # (page, error) of each page that failed in the last fetch
         
     def parse_quantity(self, quantity_str: str) -> int:
         """Parse quantity string like '10K+ bought in past month' to integer"""
-        if not quantity_str:
-            return 0
-            
-        # Extract number and multiplier
-        match = re.search(r'(\d+(?:\.\d+)?)([KMB]?)\+?', quantity_str.upper())
-        if not match:
-            return 0
-            
-        number = float(match.group(1))
-        multiplier = match.group(2)
-        
-        if multiplier == 'K':
-            return int(number * 1000)
-        elif multiplier == 'M':
-            return int(number * 1000000)
-        elif multiplier == 'B':
-            return int(number * 1000000000)
-        else:
-            return int(number)
+        return parse_quantity(quantity_str)
     
     def calculate_revenue_estimate(self, price: float, quantity_str: str) -> float:
         """Calculate estimated revenue from price and quantity sold"""
         if not price or not quantity_str:
             return 0.0
             
-        quantity = self.parse_quantity(quantity_str)
+        quantity = parse_quantity(quantity_str)
         return price * quantity
     
     def extract_products_from_results(self, results: Dict[str, Any], page_num: int) -> List[ProductData]:
@@ -78,10 +244,8 @@ class ImprovedSmartHomeTrendingAnalyzer:
                 if "extracted_price" in item:
                     price = item["extracted_price"]
                 elif "price" in item:
-                    # Try to extract price from string like "$19.99"
-                    price_match = re.search(r'\$?(\d+(?:\.\d+)?)', str(item["price"]))
-                    if price_match:
-                        price = float(price_match.group(1))
+                    # Parse price strings like "$1,299.99" or "1.299,99 €"
+                    price = parse_price(str(item["price"]))
                 
                 # Extract rating
                 rating = item.get("rating")
@@ -94,10 +258,10 @@ class ImprovedSmartHomeTrendingAnalyzer:
                     reviews = int(reviews)
                 
                 # Extract quantity sold
-                bought_last_month = item.get("bought_last_month", "")
+                bought_last_month = sys.intern(item.get("bought_last_month") or "")  # Only a handful of distinct values
                 
                 # Calculate revenue estimate
-                revenue_estimate = self.calculate_revenue_estimate(price, bought_last_month)
+                revenue_estimate = price * parse_quantity(bought_last_month) if price and bought_last_month else 0.0
                 
                 product = ProductData(
                     position=position,
@@ -121,77 +285,211 @@ class ImprovedSmartHomeTrendingAnalyzer:
                 
         return products
     
-    def fetch_smart_home_best_sellers(self, pages: int = 3) -> List[ProductData]:
-        """Fetch Smart Home best sellers from multiple pages with duplicate handling"""
-        all_products = []
-        seen_asins = set()
+    def page_params(self, page: int) -> Dict[str, Any]:
+        """API parameters for one page of best sellers in the analyzer's category"""
+        params = {
+            "api_key": self.api_key,
+            "engine": "amazon",
+            "amazon_domain": self.amazon_domain,
+            "s": "exact-aware-popularity-rank",  # Best Sellers sort
+            "node": self.node,
+            "page": page
+        }
+        if self.language:
+            params["language"] = self.language
+        return params
+    
+    def fetch_page(self, page: int) -> Dict[str, Any]:
+        """Fetch a single page of best sellers in the analyzer's category from the API"""
+        return self.cache.search(self.page_params(page), self._search)
+    
+    async def afetch_page(self, page: int, client: AsyncSerpApiClient) -> Dict[str, Any]:
+        """Async fetch_page; rate limiting is done by the client"""
+        return await self.cache.asearch(self.page_params(page), client.search)
+    
+    def _search(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return http_client.search(params, self.rate_limiter)
+    
+    def fetch_smart_home_best_sellers(self, pages: int = 3, max_workers: int = 1,
+                                      writer: Optional[JsonlWriter] = None, early_stop: bool = True,
+                                      max_duplicate_ratio: float = MAX_DUPLICATE_RATIO) -> List[ProductData]:
+        """Fetch Smart Home best sellers from multiple pages with duplicate handling
+        
+        With max_workers > 1 pages are fetched concurrently (at most max_workers
+        requests in flight), but results are still deduplicated in page order so
+        the output is identical to a serial run. If a writer is given, each new
+        product is written to it as soon as its page is processed.
         
-        for page in range(1, pages + 1):
+        With early_stop, pagination ends at the first page that fails, has no results
+        or is more than max_duplicate_ratio duplicates; pages already requested
+        beyond that point are cancelled or discarded.
+        """
+        page_numbers = list(range(1, pages + 1))
+        
+        def fetch(page: int):
             print(f"Fetching page {page}...")
-            
-            params = {
-                "api_key": self.api_key,
-                "engine": "amazon",
-                "amazon_domain": "amazon.com",
-                "language": "en_US",
-                "s": "exact-aware-popularity-rank",  # Best Sellers sort
-                "node": self.smart_home_node,  # Smart Home category
-                "page": page
-            }
-            
             try:
-                search = GoogleSearch(params)
-                results = search.get_dict()
-                
-                if "error" in results:
-                    print(f"Error on page {page}: {results['error']}")
-                    continue
-                
-                page_products = self.extract_products_from_results(results, page)
-                print(f"Found {len(page_products)} products on page {page}")
-                
-                # Filter out duplicates and add to main list
-                new_products = []
-                for product in page_products:
-                    if product.asin and product.asin not in seen_asins:
-                        seen_asins.add(product.asin)
-                        new_products.append(product)
-                    elif product.asin in seen_asins:
-                        print(f"Duplicate found: {product.asin} on page {page}")
-                
-                all_products.extend(new_products)
-                print(f"Added {len(new_products)} new products from page {page}")
-                
+                return self.fetch_page(page), None
             except Exception as e:
-                print(f"Error fetching page {page}: {e}")
-                continue
+                return None, e
+        
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                page_results = self._fetch_ahead(executor, fetch, page_numbers, max_workers)
+                try:
+                    return self._collect_unique_products(page_results, writer, early_stop=early_stop,
+                                                         max_duplicate_ratio=max_duplicate_ratio)
+                finally:
+                    page_results.close()  # Cancels speculative requests past the last useful page
+        
+        return self._collect_unique_products(((page, fetch(page)) for page in page_numbers), writer,
+                                             early_stop=early_stop, max_duplicate_ratio=max_duplicate_ratio)
+    
+    @staticmethod
+    def _fetch_ahead(executor: ThreadPoolExecutor, fetch, page_numbers: List[int], window: int):
+        """Yield (page, fetch(page)) in page order, keeping up to `window` pages requested ahead"""
+        remaining = iter(page_numbers)
+        pending = deque((page, executor.submit(fetch, page)) for page in islice(remaining, window))
+        try:
+            while pending:
+                page, future = pending.popleft()
+                result = future.result()
+                for next_page in islice(remaining, 1):
+                    pending.append((next_page, executor.submit(fetch, next_page)))
+                yield page, result
+        finally:
+            for _, future in pending:
+                future.cancel()
+    
+    def _collect_unique_products(self, page_results, writer: Optional[JsonlWriter] = None,
+                                 seen_asins: Optional[set] = None, early_stop: bool = False,
+                                 max_duplicate_ratio: float = MAX_DUPLICATE_RATIO) -> List[ProductData]:
+        """Extract products from (page, (results, error)) pairs in page order, skipping duplicate ASINs
+        
+        Pass a shared seen_asins set to also skip products already collected elsewhere.
+        """
+        all_products = []
+        if seen_asins is None:
+            seen_asins = set()
+        self.pages_analyzed = 0
+        self.page_errors = []
+        
+        for page, (results, error) in page_results:
+            self.pages_analyzed += 1
+            new_products, stop = self._unique_page_products(page, results, error, seen_asins, early_stop,
+                                                            max_duplicate_ratio)
+            if writer is not None:
+                for product in new_products:
+                    writer.write({"record": "product", **product.to_dict()})
+            all_products.extend(new_products)
+            if stop:
+                break
         
         return all_products
     
-    def rank_by_reviews(self, products: List[ProductData]) -> List[ProductData]:
+    def _unique_page_products(self, page: int, results: Optional[Dict[str, Any]], error: Optional[Exception],
+                              seen_asins: set, early_stop: bool,
+                              max_duplicate_ratio: float) -> Tuple[List[ProductData], bool]:
+        """New products of one page and whether pagination should stop after it"""
+        if error is not None:
+            print(f"Error fetching page {page}: {error}")
+            self.page_errors.append((page, str(error)))
+            return [], early_stop
+        
+        if "error" in results:
+            print(f"Error on page {page}: {results['error']}")
+            self.page_errors.append((page, str(results["error"])))
+            return [], early_stop
+        
+        page_products = self.extract_products_from_results(results, page)
+        print(f"Found {len(page_products)} products on page {page}")
+        if early_stop and not page_products:
+            print(f"No more results after page {page - 1}, stopping")
+            return [], True
+        
+        # Filter out duplicates
+        new_products = []
+        duplicates = 0
+        for product in page_products:
+            if product.asin and product.asin not in seen_asins:
+                seen_asins.add(product.asin)
+                new_products.append(product)
+            elif product.asin in seen_asins:
+                duplicates += 1
+                print(f"Duplicate found: {product.asin} on page {page}")
+        
+        print(f"Added {len(new_products)} new products from page {page}")
+        
+        if early_stop and duplicates / len(page_products) > max_duplicate_ratio:
+            print(f"Page {page} was {duplicates}/{len(page_products)} duplicates, stopping")
+            return new_products, True
+        return new_products, False
+    
+    async def afetch_smart_home_best_sellers(self, pages: int = 3, client: Optional[AsyncSerpApiClient] = None,
+                                             window: int = 4, early_stop: bool = True,
+                                             max_duplicate_ratio: float = MAX_DUPLICATE_RATIO) -> AsyncIterator[ProductData]:
+        """Async variant of fetch_smart_home_best_sellers that yields unique products as pages arrive
+        
+        Up to `window` pages are requested ahead on the event loop; products are still
+        deduplicated and yielded in page order, and early stopping works as in the sync
+        version, cancelling requests past the last useful page. Pass a shared client to
+        run many analyzers on one connection pool and rate limit.
+        """
+        if client is None:
+            async with AsyncSerpApiClient(rate=REQUESTS_PER_SECOND, burst=REQUESTS_BURST) as client:
+                async for product in self.afetch_smart_home_best_sellers(pages, client, window, early_stop,
+                                                                         max_duplicate_ratio):
+                    yield product
+            return
+        
+        async def fetch(page: int):
+            print(f"Fetching page {page}...")
+            try:
+                return await self.afetch_page(page, client), None
+            except Exception as e:
+                return None, e
+        
+        remaining = iter(range(1, pages + 1))
+        pending = deque((page, asyncio.ensure_future(fetch(page))) for page in islice(remaining, max(window, 1)))
+        seen_asins = set()
+        self.pages_analyzed = 0
+        self.page_errors = []
+        try:
+            while pending:
+                page, task = pending.popleft()
+                results, error = await task
+                for next_page in islice(remaining, 1):
+                    pending.append((next_page, asyncio.ensure_future(fetch(next_page))))
+                self.pages_analyzed += 1
+                new_products, stop = self._unique_page_products(page, results, error, seen_asins, early_stop,
+                                                                max_duplicate_ratio)
+                for product in new_products:
+                    yield product
+                if stop:
+                    break
+        finally:
+            for _, task in pending:
+                task.cancel()
+    
+    def rank_by_reviews(self, products: List[ProductData], limit: Optional[int] = None) -> List[ProductData]:
         """Rank products by number of reviews (descending)"""
-        return sorted(products, key=lambda x: x.reviews or 0, reverse=True)
+        columns = ProductColumns(products)
+        return columns.top(columns.reviews, limit)
     
-    def rank_by_rating(self, products: List[ProductData]) -> List[ProductData]:
+    def rank_by_rating(self, products: List[ProductData], limit: Optional[int] = None) -> List[ProductData]:
         """Rank products by rating (descending)"""
-        return sorted(products, key=lambda x: x.rating or 0, reverse=True)
+        columns = ProductColumns(products)
+        return columns.top(columns.rating, limit)
     
-    def rank_by_revenue(self, products: List[ProductData]) -> List[ProductData]:
+    def rank_by_revenue(self, products: List[ProductData], limit: Optional[int] = None) -> List[ProductData]:
         """Rank products by estimated revenue (descending)"""
-        return sorted(products, key=lambda x: x.revenue_estimate or 0, reverse=True)
+        columns = ProductColumns(products)
+        return columns.top(columns.revenue, limit)
     
-    def rank_by_trending_score(self, products: List[ProductData]) -> List[ProductData]:
+    def rank_by_trending_score(self, products: List[ProductData], limit: Optional[int] = None) -> List[ProductData]:
         """Rank products by a composite trending score"""
-        def calculate_trending_score(product: ProductData) -> float:
-            # Normalize and weight different factors
-            rating_score = (product.rating or 0) * 20  # 0-100 scale
-            review_score = min((product.reviews or 0) / 1000, 100)  # Cap at 100
-            revenue_score = min((product.revenue_estimate or 0) / 10000, 100)  # Cap at 100
-            
-            # Weight the scores (rating 40%, reviews 30%, revenue 30%)
-            return (rating_score * 0.4) + (review_score * 0.3) + (revenue_score * 0.3)
-        
-        return sorted(products, key=calculate_trending_score, reverse=True)
+        columns = ProductColumns(products)
+        return columns.top(columns.trending_scores(), limit)
     
     def print_ranking(self, products: List[ProductData], title: str, limit: int = 10):
         """Print a formatted ranking of products"""
@@ -209,64 +507,57 @@ class ImprovedSmartHomeTrendingAnalyzer:
             print(f"   Sold Last Month: {product.bought_last_month}")
             print(f"   Est. Revenue: ${product.revenue_estimate:,.2f}" if product.revenue_estimate else "   Est. Revenue: N/A")
     
-    def generate_comprehensive_json(self, products: List[ProductData]) -> Dict[str, Any]:
-        """Generate a comprehensive JSON with all product data"""
+    def generate_comprehensive_json(self, products: List[ProductData], include_products: bool = True) -> Dict[str, Any]:
+        """Generate a comprehensive JSON with all product data
+        
+        Pass include_products=False when the products were already streamed to a JSONL file.
+        """
         
         # Calculate statistics
+        columns = ProductColumns(products)
         total_products = len(products)
-        products_with_price = len([p for p in products if p.price])
-        products_with_rating = len([p for p in products if p.rating])
-        products_with_reviews = len([p for p in products if p.reviews])
-        products_with_quantity = len([p for p in products if p.bought_last_month])
-        
-        avg_price = sum(p.price for p in products if p.price) / products_with_price if products_with_price else 0
-        avg_rating = sum(p.rating for p in products if p.rating) / products_with_rating if products_with_rating else 0
-        total_revenue = sum(p.revenue_estimate for p in products if p.revenue_estimate)
-        
-        # Generate rankings
-        top_by_reviews = self.rank_by_reviews(products)[:10]
-        top_by_rating = self.rank_by_rating(products)[:10]
-        top_by_revenue = self.rank_by_revenue(products)[:10]
-        top_trending = self.rank_by_trending_score(products)[:10]
-        
-        # Convert products to dictionaries
-        products_data = []
-        for product in products:
-            product_dict = asdict(product)
-            products_data.append(product_dict)
+        stats = columns.statistics()
+        
+        # Generate rankings as references into all_products
+        top_by_reviews = columns.references(columns.top_indices(columns.reviews, 10))
+        top_by_rating = columns.references(columns.top_indices(columns.rating, 10))
+        top_by_revenue = columns.references(columns.top_indices(columns.revenue, 10))
+        top_trending = columns.references(columns.top_indices(columns.trending_scores(), 10))
+        
         
         comprehensive_data = {
             "analysis_metadata": {
                 "analysis_date": datetime.now().isoformat(),
-                "category": "Smart Home Best Sellers",
+                "category": self.category,
                 "api_parameters": {
                     "engine": "amazon",
-                    "amazon_domain": "amazon.com",
-                    "language": "en_US",
+                    "amazon_domain": self.amazon_domain,
+                    "language": self.language,
                     "sort": "exact-aware-popularity-rank",
-                    "node": self.smart_home_node,
-                    "pages_analyzed": 3
+                    "node": self.node,
+                    "pages_analyzed": self.pages_analyzed
                 },
                 "total_products_found": total_products,
                 "duplicates_removed": True
             },
             "statistics": {
-                "products_with_price": products_with_price,
-                "products_with_rating": products_with_rating,
-                "products_with_reviews": products_with_reviews,
-                "products_with_quantity_data": products_with_quantity,
-                "average_price": round(avg_price, 2),
-                "average_rating": round(avg_rating, 2),
-                "total_estimated_revenue": round(total_revenue, 2)
+                "products_with_price": stats["products_with_price"],
+                "products_with_rating": stats["products_with_rating"],
+                "products_with_reviews": stats["products_with_reviews"],
+                "products_with_quantity_data": stats["products_with_quantity_data"],
+                "average_price": round(stats["average_price"], 2),
+                "average_rating": round(stats["average_rating"], 2),
+                "total_estimated_revenue": round(stats["total_estimated_revenue"], 2)
             },
             "rankings": {
-                "top_by_reviews": [asdict(p) for p in top_by_reviews],
-                "top_by_rating": [asdict(p) for p in top_by_rating],
-                "top_by_revenue": [asdict(p) for p in top_by_revenue],
-                "top_trending": [asdict(p) for p in top_trending]
+                "top_by_reviews": top_by_reviews,
+                "top_by_rating": top_by_rating,
+                "top_by_revenue": top_by_revenue,
+                "top_trending": top_trending
             },
-            "all_products": products_data
         }
+        if include_products:
+            comprehensive_data["all_products"] = [product.to_dict() for product in products]
         
         return comprehensive_data
     
@@ -281,11 +572,187 @@ class ImprovedSmartHomeTrendingAnalyzer:
         
         print(f"\nComprehensive analysis saved to: {filename}")
         return filename
+    
+    def write_aggregate_sections(self, writer: JsonlWriter, data: Dict[str, Any]):
+        """Append the metadata, statistics and rankings sections to a streamed JSONL file"""
+        for section, content in data.items():
+            if section != "all_products":
+                writer.write({"record": section, **content})
+        print(f"\nComprehensive analysis saved to: {writer.filename}")
+        return writer.filename
+
+@dataclass
+class CrawlJob:
+    """One category to crawl: a browse node on an Amazon marketplace"""
+    node: str
+    amazon_domain: str = "amazon.com"
+    pages: int = 3
+    priority: int = 0  # Higher priority jobs get their pages fetched first
+    category: str = ""
+    language: Optional[str] = None  # Unset uses the marketplace's default language
+
+class CrawlScheduler:
+    """Crawl many categories concurrently under one global rate limit
+    
+    Page requests are queued by job priority, then interleaved across jobs page by page
+    so a large job cannot starve the others. ASINs are deduplicated within each job and
+    across jobs on the same marketplace, in job order, so results are deterministic.
+    """
+    
+    def __init__(self, api_key: str, jobs: List[CrawlJob], max_workers: int = 5,
+                 requests_per_second: float = REQUESTS_PER_SECOND, cache: Optional[ResponseCache] = None):
+        self.jobs = jobs
+        self.max_workers = max_workers
+        cache = cache or ResponseCache(ttls=CACHE_TTLS)
+        rate_limiter = TokenBucket(requests_per_second, REQUESTS_BURST)
+        self.analyzers = [
+            ImprovedSmartHomeTrendingAnalyzer(api_key, cache=cache, node=job.node, amazon_domain=job.amazon_domain,
+                                              category=job.category or f"Node {job.node} ({job.amazon_domain})",
+                                              rate_limiter=rate_limiter, language=job.language)
+            for job in jobs
+        ]
+    
+    def run(self, writer: Optional[JsonlWriter] = None) -> List[List[ProductData]]:
+        """Fetch every job's pages and return the unique products of each job, in job order"""
+        tasks = sorted(
+            ((job_index, page) for job_index, job in enumerate(self.jobs) for page in range(1, job.pages + 1)),
+            key=lambda task: (-self.jobs[task[0]].priority, task[1], task[0])
+        )
+        
+        def fetch(task):
+            job_index, page = task
+            job = self.jobs[job_index]
+            print(f"Fetching page {page} of node {job.node} on {job.amazon_domain}...")
+            try:
+                return self.analyzers[job_index].fetch_page(page), None
+            except Exception as e:
+                return None, e
+        
+        # The executor starts tasks in submission order, so the sorted order sets priority and fairness
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            page_results = dict(zip(tasks, executor.map(fetch, tasks)))
+        
+        seen_asins_by_domain = {}
+        results = []
+        for job_index, (job, analyzer) in enumerate(zip(self.jobs, self.analyzers)):
+            seen_asins = seen_asins_by_domain.setdefault(job.amazon_domain, set())
+            pages = ((page, page_results[(job_index, page)]) for page in range(1, job.pages + 1))
+            results.append(analyzer._collect_unique_products(pages, writer, seen_asins))
+        return results
+    
+    def generate_reports(self, results: List[List[ProductData]]) -> List[Dict[str, Any]]:
+        """Build the comprehensive JSON of each job from the output of run()"""
+        return [analyzer.generate_comprehensive_json(products)
+                for analyzer, products in zip(self.analyzers, results)]
+
+class SnapshotStore:
+    """SQLite time series of product snapshots across crawls
+    
+    `latest` holds the current state of each product per category; `history` gets a
+    row only on the days a tracked field changed, so unchanged products cost nothing
+    to re-ingest. Both tables are indexed for movement queries.
+    """
+    
+    TRACKED_FIELDS = ("rank", "price", "rating", "reviews", "bought_last_month")
+    
+    def __init__(self, path: str = SNAPSHOT_DB):
+        self.conn = sqlite3.connect(path)
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS latest (
+                    asin TEXT, node TEXT, domain TEXT, title TEXT,
+                    rank INTEGER, price REAL, rating REAL, reviews INTEGER, bought_last_month INTEGER,
+                    first_seen TEXT, last_seen TEXT,
+                    PRIMARY KEY (asin, node, domain)
+                );
+                CREATE TABLE IF NOT EXISTS history (
+                    asin TEXT, node TEXT, domain TEXT, observed_on TEXT,
+                    rank INTEGER, price REAL, rating REAL, reviews INTEGER, bought_last_month INTEGER,
+                    PRIMARY KEY (asin, node, domain, observed_on)
+                );
+                CREATE INDEX IF NOT EXISTS latest_by_category ON latest (node, domain, last_seen);
+            """)
+    
+    def ingest(self, analyzer: ImprovedSmartHomeTrendingAnalyzer, products: List[ProductData],
+               observed_on: Optional[date] = None) -> int:
+        """Record a crawl of the analyzer's category; returns the number of products that changed"""
+        day = (observed_on or date.today()).isoformat()
+        node, domain = analyzer.node, analyzer.amazon_domain
+        previous = {
+            row[0]: row[1:]
+            for row in self.conn.execute(
+                f"SELECT asin, {', '.join(self.TRACKED_FIELDS)} FROM latest WHERE node = ? AND domain = ?",
+                (node, domain)
+            )
+        }
+        changed, unchanged = [], []
+        for rank, product in enumerate(products, 1):
+            values = (rank, product.price, product.rating, product.reviews,
+                      analyzer.parse_quantity(product.bought_last_month))
+            if previous.get(product.asin) == values:
+                unchanged.append((day, product.asin, node, domain))
+            else:
+                changed.append((product, values))
+        
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(product.asin, node, domain, day, *values) for product, values in changed]
+            )
+            self.conn.executemany(
+                "INSERT INTO latest VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (asin, node, domain) DO UPDATE SET title = excluded.title, rank = excluded.rank, "
+                "price = excluded.price, rating = excluded.rating, reviews = excluded.reviews, "
+                "bought_last_month = excluded.bought_last_month, last_seen = excluded.last_seen",
+                [(product.asin, node, domain, product.title, *values, day, day) for product, values in changed]
+            )
+            self.conn.executemany(
+                "UPDATE latest SET last_seen = ? WHERE asin = ? AND node = ? AND domain = ?", unchanged
+            )
+        return len(changed)
+    
+    def movers(self, node: str, domain: str = "amazon.com", field: str = "bought_last_month",
+               days: int = 7, limit: int = 20) -> List[Dict[str, Any]]:
+        """Products whose field improved the most over the last `days` days
+        
+        Compares the latest value with the last value recorded on or before the start of
+        the window. For rank, improving means moving to a smaller number.
+        """
+        if field not in self.TRACKED_FIELDS:
+            raise ValueError(f"Unknown field {field!r}, expected one of {self.TRACKED_FIELDS}")
+        since = (date.today() - timedelta(days=days)).isoformat()
+        change = f"h.{field} - l.{field}" if field == "rank" else f"l.{field} - h.{field}"
+        rows = self.conn.execute(f"""
+            SELECT l.asin, l.title, h.{field}, l.{field}, {change} AS change
+            FROM latest l
+            JOIN history h ON h.asin = l.asin AND h.node = l.node AND h.domain = l.domain
+                AND h.observed_on = (
+                    SELECT MAX(observed_on) FROM history
+                    WHERE asin = l.asin AND node = l.node AND domain = l.domain AND observed_on <= ?
+                )
+            WHERE l.node = ? AND l.domain = ? AND l.last_seen >= ? AND change > 0
+            ORDER BY change DESC
+            LIMIT ?
+        """, (since, node, domain, since, limit))
+        return [{"asin": asin, "title": title, "before": before, "now": now, "change": change}
+                for asin, title, before, now, change in rows]
+    
+    def product_history(self, asin: str, node: str, domain: str = "amazon.com") -> List[Dict[str, Any]]:
+        """All recorded changes of one product in a category, oldest first"""
+        rows = self.conn.execute(
+            f"SELECT observed_on, {', '.join(self.TRACKED_FIELDS)} FROM history "
+            "WHERE asin = ? AND node = ? AND domain = ? ORDER BY observed_on",
+            (asin, node, domain)
+        )
+        return [dict(zip(("observed_on",) + self.TRACKED_FIELDS, row)) for row in rows]
+    
+    def close(self):
+        self.conn.close()
 
 def main():
     """Main function to run the improved Smart Home trending analysis"""
     # Your API key
-    api_key = "your-api-key"
+    api_key = os.getenv("SERPAPI_API_KEY", "your-api-key")
     
     print("Improved Smart Home Trending Products Analyzer")
     print("=" * 60)
@@ -293,10 +760,16 @@ def main():
     # Initialize analyzer
     analyzer = ImprovedSmartHomeTrendingAnalyzer(api_key)
     
+    # Stream products to a JSONL file while fetching, or write one JSON document at the end
+    writer = None
+    if OUTPUT_FORMAT != "json":
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        writer = JsonlWriter(f"smart_home_comprehensive_analysis_{timestamp}.{OUTPUT_FORMAT}")
+    
     try:
         # Fetch products from multiple pages with duplicate handling
         print("Fetching Smart Home best sellers with duplicate detection...")
-        products = analyzer.fetch_smart_home_best_sellers(pages=3)
+        products = analyzer.fetch_smart_home_best_sellers(pages=3, writer=writer)
         
         if not products:
             print("No products found. Please check your API key and try again.")
@@ -306,10 +779,19 @@ def main():
         
         # Generate comprehensive JSON
         print("\n Generating comprehensive JSON analysis...")
-        comprehensive_data = analyzer.generate_comprehensive_json(products)
+        comprehensive_data = analyzer.generate_comprehensive_json(products, include_products=writer is None)
         
         # Save comprehensive JSON
-        json_file = analyzer.save_comprehensive_json(comprehensive_data)
+        if writer is not None:
+            json_file = analyzer.write_aggregate_sections(writer, comprehensive_data)
+        else:
+            json_file = analyzer.save_comprehensive_json(comprehensive_data)
+        
+        # Record this crawl so later runs can compare against it
+        store = SnapshotStore()
+        changed = store.ingest(analyzer, products)
+        store.close()
+        print(f"Recorded {changed} new or changed products in {SNAPSHOT_DB}")
         
         # Print summary
         print(f"\n ANALYSIS SUMMARY")
@@ -322,18 +804,21 @@ def main():
         
         # Show top 5 from each ranking
         print(f"\n🔥 TOP 5 BY REVIEWS:")
-        top_reviews = analyzer.rank_by_reviews(products)
-        for i, p in enumerate(top_reviews[:5], 1):
+        top_reviews = analyzer.rank_by_reviews(products, limit=5)
+        for i, p in enumerate(top_reviews, 1):
             print(f"{i}. {p.title[:50]}... - {p.reviews:,} reviews")
         
         print(f"\n💰 TOP 5 BY REVENUE:")
-        top_revenue = analyzer.rank_by_revenue(products)
-        for i, p in enumerate(top_revenue[:5], 1):
+        top_revenue = analyzer.rank_by_revenue(products, limit=5)
+        for i, p in enumerate(top_revenue, 1):
             print(f"{i}. {p.title[:50]}... - ${p.revenue_estimate:,.2f}")
         
     except Exception as e:
         print(f"❌ Error occurred: {str(e)}")
         print("Please check your API key and internet connection.")
+    finally:
+        if writer is not None:
+            writer.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
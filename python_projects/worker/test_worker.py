@@ -0,0 +1,99 @@
+"""Checks of the job queue's leases and of failed crawls being retried instead of marked done
+
+    pip install pytest
+    pytest test_worker.py
+"""
+import sqlite3
+
+import pytest
+
+import worker
+from worker import MAX_ATTEMPTS, JobQueue
+
+UNREACHABLE = "http://127.0.0.1:1"
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"))
+
+def expire_leases(queue):
+    """Make every running job look as if its worker stopped heartbeating long ago"""
+    conn = sqlite3.connect(queue.path)
+    with conn:
+        conn.execute("UPDATE jobs SET heartbeat_at = 0 WHERE status = 'running'")
+    conn.close()
+
+def test_claim_takes_the_highest_priority_job_first(queue):
+    low = queue.enqueue("competitor", {"target": "low"})
+    high = queue.enqueue("competitor", {"target": "high"}, priority=10)
+    also_low = queue.enqueue("competitor", {"target": "also low"})
+    assert [queue.claim("A")["id"] for _ in range(3)] == [high, low, also_low]
+    assert queue.claim("A") is None
+    assert queue.counts() == {"running": 3}
+
+def test_expired_lease_counts_as_an_attempt(queue):
+    job_id = queue.enqueue("competitor", {"target": "x"})
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        job = queue.claim(f"worker-{attempt}")
+        assert (job["id"], job["attempt"]) == (job_id, attempt)
+        expire_leases(queue)
+    assert queue.claim("next") is None
+    assert queue.counts() == {"failed": 1}
+    error = queue.recent()[0][7]
+    assert error == f"Lease expired: worker worker-{MAX_ATTEMPTS} stopped heartbeating"
+
+def test_only_the_lease_holder_can_finish_a_job(queue):
+    job_id = queue.enqueue("competitor", {"target": "x"})
+    queue.claim("A")
+    expire_leases(queue)
+    assert queue.claim("B")["attempt"] == 2
+
+    assert not queue.heartbeat(job_id, "A")
+    assert not queue.complete(job_id, "A", {"output": "stale"})
+    assert not queue.fail(job_id, "A", "stale")
+    assert queue.counts() == {"running": 1}
+
+    assert queue.heartbeat(job_id, "B")
+    assert queue.complete(job_id, "B", {"output": "fresh"})
+    assert queue.counts() == {"done": 1}
+    assert not queue.fail(job_id, "B", "too late")
+
+def test_failure_requeues_until_attempts_are_used_up(queue):
+    job_id = queue.enqueue("competitor", {"target": "x"})
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        assert queue.claim("A")["attempt"] == attempt
+        assert queue.fail(job_id, "A", f"error {attempt}")
+    assert queue.counts() == {"failed": 1}
+    assert queue.recent()[0][7] == f"error {MAX_ATTEMPTS}"
+
+@pytest.mark.parametrize("products, page_errors, message", [
+    ([], [], "No products collected"),
+    ([1, 2], [(1, "HTTP 503")], "First page of x failed: HTTP 503"),
+    ([], [(2, "timeout")], "page 2 failed: timeout"),
+])
+def test_check_crawl_rejects_failed_crawls(products, page_errors, message):
+    with pytest.raises(RuntimeError, match=message):
+        worker.check_crawl(products, page_errors, "x")
+
+def test_check_crawl_accepts_a_partial_crawl():
+    worker.check_crawl([1, 2], [(3, "HTTP 503")], "x")
+
+@pytest.fixture
+def tools(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # Caches and the snapshot store are created in the working directory
+    tools = worker.Tools(1, str(tmp_path))
+    for module in (tools.trending, tools.competitor):
+        monkeypatch.setattr(module, "http_client", module.SerpApiClient(UNREACHABLE, retries=0))
+    return tools
+
+def test_unreachable_api_fails_the_crawl_jobs(tools, tmp_path):
+    with pytest.raises(RuntimeError, match="First page of node 123"):
+        tools.run_trending("123", pages=2)
+    with pytest.raises(RuntimeError, match="First page of 'speakers'"):
+        tools.run_competitor("speakers")
+    assert [path.name for path in tmp_path.iterdir() if path.suffix in (".json", ".jsonl")] == []
+    assert not (tmp_path / tools.trending.SNAPSHOT_DB).exists()  # The empty crawl was not recorded as a snapshot
+
+def test_api_key_is_masked_in_stored_errors():
+    error = "HTTPConnectionPool: Max retries exceeded with url: /search?api_key=secret123&engine=amazon"
+    assert worker.API_KEY_PATTERN.sub(r"\1***", error) == error.replace("secret123", "***")
@@ -0,0 +1,393 @@
+"""Long-running worker service for the three python_projects tools
+
+Jobs are queued in a SQLite file and processed by one worker process per CPU core.
+Each process imports the tools once and keeps their HTTP connection pools, the
+response caches and the LLM client warm across jobs.
+
+    python worker.py enqueue predictor "Austin, TX" --insights
+    python worker.py enqueue trending 6563140011 --pages 5 --category "Smart Home"
+    python worker.py enqueue competitor "bluetooth speakers" --pages 2
+    python worker.py enqueue --file jobs.jsonl        # {"kind": ..., "target": ..., ...} per line
+    python worker.py run                              # one process per core, until Ctrl+C
+    python worker.py run --processes 2 --until-empty
+    python worker.py status
+
+Requires the packages of all three projects (numpy, requests, openai,
+python-dotenv) and SERPAPI_API_KEY in the environment or .env.
+"""
+import argparse
+import contextlib
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import re
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import datetime
+
+PROJECTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUEUE_PATH = os.getenv("WORKER_QUEUE_PATH", "jobs.sqlite3")
+OUTPUT_DIR = "worker_output"
+JOB_OPTIONS = {  # Options each kind of job accepts besides its target
+    "predictor": {"insights", "map_reduce"},
+    "trending": {"pages", "amazon_domain", "category", "language"},
+    "competitor": {"pages"},
+}
+JOB_KINDS = tuple(JOB_OPTIONS)
+MAX_ATTEMPTS = 3       # A failing job is retried until it has run this many times
+LEASE_SECONDS = 300    # A running job whose worker stopped heartbeating for this long is requeued
+HEARTBEAT_SECONDS = 60
+POLL_INTERVAL = 2      # Seconds an idle worker waits before checking the queue again
+API_KEY_PATTERN = re.compile(r"(api_key=)[^&\s'\"]+")  # Request URLs in errors carry the key; it is masked before storing
+
+class JobQueue:
+    """SQLite job queue shared by every worker process
+
+    Jobs are claimed atomically, so each one runs in exactly one process. A job whose
+    worker crashed is handed out again once its lease expires, and failed jobs are
+    retried up to MAX_ATTEMPTS times. Only the worker holding a job's lease can renew,
+    complete or fail it, so a worker that lost its lease cannot overwrite the new run.
+    """
+
+    def __init__(self, path=QUEUE_PATH):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")  # Readers (status) never block the workers
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL,
+                    started_at REAL,
+                    heartbeat_at REAL,
+                    finished_at REAL
+                );
+                CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, priority DESC, id);
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, kind, payload, priority=0):
+        if kind not in JOB_OPTIONS:
+            raise ValueError(f"Unknown job kind: {kind} (expected one of {', '.join(JOB_KINDS)})")
+        if not payload.get("target"):
+            raise ValueError(f"{kind} job needs a target")
+        unknown = set(payload) - JOB_OPTIONS[kind] - {"target"}
+        if unknown:
+            raise ValueError(f"{kind} jobs do not accept: {', '.join(sorted(unknown))}")
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, payload, priority, created_at) VALUES (?, ?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), priority, time.time())
+            )
+            return cursor.lastrowid
+
+    def claim(self, worker):
+        """Mark the next queued job as running for worker and return it, or None if there is none"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                "error = 'Lease expired: worker ' || worker || ' stopped heartbeating', worker = NULL, finished_at = ? "
+                "WHERE status = 'running' AND heartbeat_at < ?",
+                (MAX_ATTEMPTS, now, now - LEASE_SECONDS)
+            )
+            row = conn.execute(
+                "SELECT id, kind, payload, attempts FROM jobs WHERE status = 'queued' ORDER BY priority DESC, id LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, "
+                    "started_at = ?, heartbeat_at = ? WHERE id = ?",
+                    (worker, now, now, row[0])
+                )
+            conn.execute("COMMIT")
+        if row is None:
+            return None
+        return {"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "attempt": row[3] + 1}
+
+    # heartbeat, complete and fail return False when worker no longer holds the job's lease
+
+    def heartbeat(self, job_id, worker):
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running' AND worker = ?",
+                (time.time(), job_id, worker)
+            ).rowcount > 0
+
+    def complete(self, job_id, worker, result):
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, finished_at = ? "
+                "WHERE id = ? AND status = 'running' AND worker = ?",
+                (json.dumps(result, ensure_ascii=False), time.time(), job_id, worker)
+            ).rowcount > 0
+
+    def fail(self, job_id, worker, error):
+        """Record a failure; the job goes back in the queue unless it has used up its attempts"""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                "error = ?, worker = NULL, finished_at = ? WHERE id = ? AND status = 'running' AND worker = ?",
+                (MAX_ATTEMPTS, error, time.time(), job_id, worker)
+            ).rowcount > 0
+
+    def pending(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+
+    def counts(self):
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def recent(self, limit=20):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT id, kind, payload, status, attempts, worker, result, error, started_at, finished_at "
+                "FROM jobs ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+
+def load_module(name, relative_path):
+    """Import one of the project scripts by path (their folders are not packages)"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PROJECTS_DIR, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def slugify(text):
+    return re.sub(r"[^A-Za-z0-9]+", "_", str(text)).strip("_").lower()
+
+class Tools:
+    """The three tools, imported once per worker process and reused for every job it runs
+
+    The SerpApi rate limit of each tool is divided between the worker processes, so the
+    whole service stays within the plan's throughput however many cores it uses. Each
+    tool's SerpApiClient keeps its connections open between jobs.
+    """
+
+    def __init__(self, processes, output_dir):
+        self.output_dir = output_dir
+        self.api_key = os.getenv("SERPAPI_API_KEY")
+        self.trending = load_module("trending_products", "trending-products-amazon-api/trending_products.py")
+        self.competitor = load_module("competitor_traker", "competitor-tracker-amazon-api/competitor_traker.py")
+        self.predictor = load_module("predictor_main", "business-success-predictor/main.py")
+        for module in (self.trending, self.competitor, self.predictor):
+            module.rate_limiter = module.TokenBucket(module.REQUESTS_PER_SECOND / processes, module.REQUESTS_BURST)
+        self.trending_cache = self.trending.ResponseCache(ttls=self.trending.CACHE_TTLS)
+        self.llm_client = None
+
+    def run(self, kind, payload):
+        return getattr(self, f"run_{kind}")(**payload)
+
+    def run_predictor(self, target, insights=False, map_reduce=False):
+        predictor = self.predictor
+        if self.llm_client is None:
+            self.llm_client = predictor.create_llm_client()
+        prompt = predictor.prepare_prompt(target, self.api_key, self.llm_client, map_reduce, None, insights)
+        ai_output = predictor.generate_analysis(self.llm_client, prompt)
+        filename = os.path.join(self.output_dir, f"ai_response_{slugify(target)}.md")
+        with open(filename, "w", encoding="utf-8") as md_file:
+            md_file.write(ai_output)
+        return {"output": filename}
+
+    def run_trending(self, target, pages=3, amazon_domain="amazon.com", category=None, language=None):
+        trending = self.trending
+        analyzer = trending.ImprovedSmartHomeTrendingAnalyzer(
+            self.api_key, cache=self.trending_cache, node=target, amazon_domain=amazon_domain,
+            category=category or f"Node {target} ({amazon_domain})", rate_limiter=trending.rate_limiter,
+            language=language
+        )
+        products = analyzer.fetch_smart_home_best_sellers(pages=pages)
+        check_crawl(products, analyzer.page_errors, f"node {target} on {amazon_domain}")
+        data = analyzer.generate_comprehensive_json(products)
+        filename = os.path.join(self.output_dir, f"trending_{slugify(amazon_domain)}_{target}_{datetime.now():%Y%m%d_%H%M%S}.json")
+        analyzer.save_comprehensive_json(data, filename)
+        store = trending.SnapshotStore()
+        try:
+            changed = store.ingest(analyzer, products)
+        finally:
+            store.close()
+        return {"output": filename, "products": len(products), "changed": changed}
+
+    def run_competitor(self, target, pages=1, max_workers=5):
+        competitor = self.competitor
+        filename = os.path.join(self.output_dir, f"competitor_{slugify(target)}_{datetime.now():%Y%m%d_%H%M%S}.jsonl")
+        errors = []
+        summary = competitor.save_to_jsonl(competitor.track_keywords(self.api_key, [target], pages, max_workers, errors), filename)
+        try:
+            check_crawl(range(summary["total_products"]), [(page, error) for _, page, error in errors], repr(target))
+        except RuntimeError:
+            os.remove(filename)
+            raise
+        return {"output": filename, "products": summary["total_products"]}
+
+def check_crawl(products, page_errors, what):
+    """Raise when the first page failed or nothing was collected, so the job is retried instead of done
+
+    The tools report failed pages and carry on; page_errors holds their (page, error) pairs.
+    """
+    first_page_errors = [error for page, error in page_errors if page == 1]
+    if first_page_errors:
+        raise RuntimeError(f"First page of {what} failed: {first_page_errors[0]}")
+    if not products:
+        detail = f": page {page_errors[0][0]} failed: {page_errors[0][1]}" if page_errors else ""
+        raise RuntimeError(f"No products collected for {what}{detail}")
+
+def keep_alive(queue, job_id, worker, finished):
+    """Renew a running job's lease until it finishes, so long LLM calls are not handed out twice"""
+    while not finished.wait(HEARTBEAT_SECONDS):
+        if not queue.heartbeat(job_id, worker):
+            return
+
+def worker_loop(queue_path, processes, output_dir, stop, until_empty):
+    """Body of one worker process: claim jobs until stopped (or until the queue is empty)"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent handles Ctrl+C and sets `stop`
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    os.makedirs(output_dir, exist_ok=True)
+    queue = JobQueue(queue_path)
+    with contextlib.redirect_stdout(sys.stderr):  # The tools print progress; keep stdout for the service log
+        tools = Tools(processes, output_dir)
+    tools.predictor.logger.setLevel(logging.WARNING)
+    devnull = open(os.devnull, "w")
+    while not stop.is_set():
+        job = queue.claim(name)
+        if job is None:
+            if until_empty and queue.pending() == 0:
+                return
+            stop.wait(POLL_INTERVAL)
+            continue
+        started = time.perf_counter()
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=keep_alive, args=(queue, job["id"], name, finished), daemon=True)
+        heartbeat.start()
+        try:
+            with contextlib.redirect_stdout(devnull):
+                result = tools.run(job["kind"], job["payload"])
+        except Exception as e:
+            error = API_KEY_PATTERN.sub(r"\1***", f"{e}\n{traceback.format_exc(limit=5)}")
+            if queue.fail(job["id"], name, error):
+                print(f"[{name}] job {job['id']} ({job['kind']} {job['payload'].get('target')}) failed on attempt {job['attempt']}: {error.splitlines()[0]}", flush=True)
+            else:
+                print(f"[{name}] job {job['id']} failed after its lease expired; the error was discarded", flush=True)
+            continue
+        finally:
+            finished.set()
+            heartbeat.join()
+            tools.predictor.metrics.clear_events()  # Span events are only written by the CLI's --metrics; keep memory flat
+        if not queue.complete(job["id"], name, result):
+            print(f"[{name}] job {job['id']} finished after its lease expired; the result was discarded", flush=True)
+            continue
+        print(f"[{name}] job {job['id']} ({job['kind']} {job['payload'].get('target')}) done in "
+              f"{time.perf_counter() - started:.1f}s -> {result.get('output')}", flush=True)
+
+def run_service(queue_path, processes, output_dir, until_empty=False):
+    stop = multiprocessing.Event()
+    workers = [
+        multiprocessing.Process(target=worker_loop, args=(queue_path, processes, output_dir, stop, until_empty), daemon=True)
+        for _ in range(processes)
+    ]
+    print(f"Starting {processes} worker processes on {queue_path}")
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        print("Stopping after the current jobs...")
+        stop.set()
+        for worker in workers:
+            worker.join()
+
+def read_jobs(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def print_status(queue):
+    counts = queue.counts()
+    print(", ".join(f"{status}: {counts.get(status, 0)}" for status in ("queued", "running", "done", "failed")))
+    for job_id, kind, payload, status, attempts, worker, result, error, started_at, finished_at in queue.recent():
+        target = json.loads(payload).get("target")
+        duration = f"{finished_at - started_at:.1f}s" if started_at and finished_at and status == "done" else ""
+        detail = json.loads(result).get("output") if result else (error or "").splitlines()[0] if error else ""
+        print(f"{job_id:>6} {kind:<10} {status:<8} {attempts} {duration:>8}  {target}  {detail or ''}")
+
+def main():
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    parser = argparse.ArgumentParser(description="Queue and run predictor, trending and competitor jobs")
+    parser.add_argument("--queue", default=QUEUE_PATH, help="SQLite job queue file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = commands.add_parser("enqueue", help="Add jobs to the queue")
+    enqueue.add_argument("kind", nargs="?", choices=JOB_KINDS)
+    enqueue.add_argument("target", nargs="?", help="Location, category node ID or keyword")
+    enqueue.add_argument("--file", help="JSONL file of jobs: {\"kind\": ..., \"target\": ..., other options}")
+    enqueue.add_argument("--priority", type=int, default=0, help="Higher runs first")
+    enqueue.add_argument("--pages", type=int, help="Result pages (trending, competitor)")
+    enqueue.add_argument("--domain", help="Amazon marketplace (trending)")
+    enqueue.add_argument("--category", help="Category name for reports (trending)")
+    enqueue.add_argument("--language", help="Result language such as en_US; defaults to the marketplace's (trending)")
+    enqueue.add_argument("--insights", action="store_true", help="Send review statistics instead of raw reviews (predictor)")
+    enqueue.add_argument("--map-reduce", action="store_true", help="Summarize each competitor first (predictor)")
+
+    run = commands.add_parser("run", help="Process jobs with a pool of worker processes")
+    run.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    run.add_argument("--output-dir", default=OUTPUT_DIR)
+    run.add_argument("--until-empty", action="store_true", help="Exit once no jobs are queued or running")
+
+    commands.add_parser("status", help="Show job counts and the latest jobs")
+    args = parser.parse_args()
+
+    queue = JobQueue(args.queue)
+    if args.command == "enqueue":
+        jobs = read_jobs(args.file) if args.file else []
+        if args.kind:
+            if not args.target:
+                parser.error("enqueue needs a target")
+            options = {"pages": args.pages, "amazon_domain": args.domain, "category": args.category, "language": args.language,
+                       "insights": args.insights or None, "map_reduce": args.map_reduce or None}
+            jobs.append({"kind": args.kind, "target": args.target, **{k: v for k, v in options.items() if v is not None}})
+        if not jobs:
+            parser.error("nothing to enqueue: give a kind and target, or --file")
+        for job in jobs:
+            job = dict(job)
+            kind = job.pop("kind", None)
+            priority = job.pop("priority", args.priority)
+            try:
+                job_id = queue.enqueue(kind, job, priority)
+            except ValueError as e:
+                parser.error(str(e))
+            print(f"Queued job {job_id}: {kind} {job['target']}")
+    elif args.command == "run":
+        run_service(args.queue, max(args.processes, 1), args.output_dir, args.until_empty)
+    else:
+        print_status(queue)
+
+if __name__ == "__main__":
+    main()